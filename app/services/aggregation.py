@@ -1,15 +1,69 @@
+import numpy as np
 import pandas as pd
+from app.services.rolling_features import rolling_window_features
+from app.services.instrumentation import instrumented
+
+# Grain of the rollup cube; keys missing from the frame are skipped
+ROLLUP_KEYS = ['UserID', 'TXN_DATE', 'Hour', 'TXN_TYPE', 'CURRENCY', 'CURRENCY_CODE', 'MERC_TXN_ID']
+
+# Compact frames hold amounts as float32, which cannot represent totals past
+# 2**24 exactly; money is always summed in float64
+MONEY_COLUMNS = ['TXN_AMOUNT', 'FEE_AMOUNT']
+
+def _float64_money(df):
+    upcast = {column: df[column].astype('float64') for column in MONEY_COLUMNS
+              if column in df.columns and df[column].dtype == 'float32'}
+    return df.assign(**upcast) if upcast else df
+
+@instrumented
+def build_rollup(df):
+    """
+    Pre-aggregate the cleaned frame in one groupby at (UserID, day, Hour,
+    TXN_TYPE, CURRENCY, MERC_TXN_ID) grain.
+
+    The cube keeps the raw column names: TXN_DATE is the day (midnight),
+    TXN_AMOUNT and FEE_AMOUNT are sums, Txn_Count is the row count, and
+    YearMonth / Weekend are carried along. The spend functions below accept
+    it in place of the raw frame and roll it up further, so repeated
+    queries cost O(cube) instead of O(transactions). Functions that need
+    individual transactions (distribution, rolling, recurring) do not.
+    """
+    df = _float64_money(df)
+    keys = [key for key in ROLLUP_KEYS if key in df.columns]
+    grouped = df.assign(
+        TXN_DATE=df['TXN_DATE'].dt.normalize(),
+        Txn_Count=1,
+        # Per-row ratio sums so the cube can still give the mean ratio
+        Fee_Ratio_Sum=df['Fee_to_Txn_Ratio'].fillna(0) if 'Fee_to_Txn_Ratio' in df.columns else 0.0,
+        Fee_Ratio_Count=df['Fee_to_Txn_Ratio'].notna().astype('int64') if 'Fee_to_Txn_Ratio' in df.columns else 0
+    ).groupby(keys, observed=True, dropna=False, sort=True)
+
+    aggregations = {'TXN_AMOUNT': 'sum', 'Txn_Count': 'sum', 'Fee_Ratio_Sum': 'sum', 'Fee_Ratio_Count': 'sum'}
+    if 'FEE_AMOUNT' in df.columns:
+        aggregations['FEE_AMOUNT'] = 'sum'
+    cube = grouped.agg(aggregations).reset_index()
+
+    cube['YearMonth'] = cube['TXN_DATE'].dt.to_period('M')
+    cube['Weekend'] = (cube['TXN_DATE'].dt.weekday >= 5).astype('int64')
+    return cube
+
+def _is_rollup(df):
+    return 'Txn_Count' in df.columns
 
 # 1. Total Spend per User
+@instrumented
 def calculate_total_spend(df):
-    total_spend = df.groupby('UserID')['TXN_AMOUNT'].sum().reset_index()
+    df = _float64_money(df)
+    total_spend = df.groupby('UserID', observed=True)['TXN_AMOUNT'].sum().reset_index()
     total_spend.rename(columns={'TXN_AMOUNT': 'Total_Spend'}, inplace=True)
     return total_spend
 
 # 2. Monthly Spend Trend (Per User)
+@instrumented
 def analyze_monthly_spend(df):
+    df = _float64_money(df)
     monthly_spend = (
-        df.groupby(['UserID', df['YearMonth'].astype(str)])['TXN_AMOUNT']
+        df.groupby(['UserID', df['YearMonth'].astype(str)], observed=True)['TXN_AMOUNT']
         .sum()
         .reset_index()
         .rename(columns={'TXN_AMOUNT': 'Monthly_Spend'})
@@ -21,112 +75,264 @@ def transaction_amount_distribution(df):
     txn_distribution = df['TXN_AMOUNT']
     return txn_distribution
 
+@instrumented
+def binned_amount_distribution(df, bins=30, kde_points=200, kde_bins=1024):
+    """
+    Histogram, KDE curve, mean and median of TXN_AMOUNT as one small frame
+    (Part / X / X_End / Y), so the distribution chart is drawn from a fixed
+    number of points however many transactions there are:
+    - 'bin' rows: X to X_End, Y = transaction count
+    - 'kde' rows: X on an even grid over [min, max], Y = density scaled to
+      counts per bin (as histplot(kde=True) draws it)
+    - 'mean' / 'median' rows: X = the statistic
+
+    The KDE uses seaborn's default Scott bandwidth, applied to kde_bins
+    fine bin counts rather than to every transaction.
+    """
+    amounts = df['TXN_AMOUNT'].dropna().to_numpy(dtype=float)
+    if len(amounts) == 0:
+        return pd.DataFrame(columns=['Part', 'X', 'X_End', 'Y'])
+
+    counts, edges = np.histogram(amounts, bins=bins)
+    parts = [pd.DataFrame({'Part': 'bin', 'X': edges[:-1], 'X_End': edges[1:], 'Y': counts.astype(float)})]
+
+    std = amounts.std(ddof=1) if len(amounts) > 1 else 0.0
+    if std > 0:
+        bandwidth = std * len(amounts) ** (-1 / 5)
+        fine_counts, fine_edges = np.histogram(amounts, bins=kde_bins, range=(edges[0], edges[-1]))
+        centers = (fine_edges[:-1] + fine_edges[1:]) / 2
+        grid = np.linspace(edges[0], edges[-1], kde_points)
+        kernel = np.exp(-0.5 * ((grid[:, None] - centers[None, :]) / bandwidth) ** 2)
+        density = kernel @ fine_counts / (len(amounts) * bandwidth * np.sqrt(2 * np.pi))
+        parts.append(pd.DataFrame({'Part': 'kde', 'X': grid, 'X_End': np.nan,
+                                   'Y': density * len(amounts) * (edges[1] - edges[0])}))
+
+    parts.append(pd.DataFrame({'Part': ['mean', 'median'], 'X': [amounts.mean(), np.median(amounts)],
+                               'X_End': np.nan, 'Y': np.nan}))
+    return pd.concat(parts, ignore_index=True)
+
 # 4. Spend by Transaction Type
+@instrumented
 def spend_by_transaction_type(df):
-    txn_type_spend = df.groupby('TXN_TYPE')['TXN_AMOUNT'].sum().reset_index()
+    df = _float64_money(df)
+    txn_type_spend = df.groupby('TXN_TYPE', observed=True)['TXN_AMOUNT'].sum().reset_index()
     txn_type_spend.rename(columns={'TXN_AMOUNT': 'Total_Spend'}, inplace=True)
     return txn_type_spend
 
 # 5. Top Merchants by Volume and Value (Per User)
-def top_merchants(df, top_n=10):
-    top_merchant_volume = (
-        df.groupby(['UserID', 'MERC_TXN_ID'])
-        .size()
-        .reset_index(name='Transaction_Count')
-        .sort_values(by='Transaction_Count', ascending=False)
-        .groupby('UserID')
-        .head(top_n)
-        .reset_index(drop=True)
-    )
+@instrumented
+def build_merchant_table(df):
+    """
+    Transaction_Count and Total_Spend per (UserID, MERC_TXN_ID) from one
+    grouped aggregation. Accepts the raw frame or the rollup cube.
+    """
+    df = _float64_money(df)
+    grouped = df.groupby(['UserID', 'MERC_TXN_ID'], observed=True)
+    count = ('Txn_Count', 'sum') if _is_rollup(df) else ('TXN_AMOUNT', 'size')
+    return grouped.agg(Transaction_Count=count, Total_Spend=('TXN_AMOUNT', 'sum')).reset_index()
 
-    top_merchant_value = (
-        df.groupby(['UserID', 'MERC_TXN_ID'])['TXN_AMOUNT']
-        .sum()
-        .reset_index()
-        .sort_values(by='TXN_AMOUNT', ascending=False)
-        .rename(columns={'TXN_AMOUNT': 'Total_Spend'})
-        .groupby('UserID')
-        .head(top_n)
-        .reset_index(drop=True)
-    )
+@instrumented
+def update_merchant_table(merchant_table, new_df):
+    """
+    Fold new transactions into a build_merchant_table() result: only the new
+    rows are aggregated, then combined with the (much smaller) table.
+    """
+    combined = pd.concat([merchant_table, build_merchant_table(new_df)], ignore_index=True)
+    return combined.groupby(['UserID', 'MERC_TXN_ID'], observed=True, as_index=False)[
+        ['Transaction_Count', 'Total_Spend']].sum()
+
+def _top_per_user(merchant_table, column, top_n):
+    # Rank within each user instead of sorting the whole table; ties keep merchant order
+    rank = merchant_table.groupby('UserID', observed=True)[column].rank(method='first', ascending=False)
+    top = merchant_table.loc[(rank <= top_n).to_numpy(), ['UserID', 'MERC_TXN_ID', column]]
+    return top.sort_values(column, ascending=False, kind='stable').reset_index(drop=True)
+
+@instrumented
+def top_merchants(df, top_n=10, merchant_table=None):
+    """
+    Each user's top_n merchants by transaction count and by spend, from one
+    merchant table (built here unless a precomputed one is passed).
+    """
+    if merchant_table is None:
+        merchant_table = build_merchant_table(df)
+
+    top_merchant_volume = _top_per_user(merchant_table, 'Transaction_Count', top_n)
+    top_merchant_value = _top_per_user(merchant_table, 'Total_Spend', top_n)
 
     return top_merchant_volume, top_merchant_value
 
-def get_top_merchants_for_user(df, user_id, top_n=10):
-    user_df = df[df['UserID'] == user_id]
+@instrumented
+def get_top_merchants_for_user(df, user_id, top_n=10, user_index=None, merchant_table=None):
+    if merchant_table is not None:
+        user_table = merchant_table[merchant_table['UserID'] == user_id]
+        return top_merchants(None, top_n=top_n, merchant_table=user_table)
+
+    # With the frame's UserIndex the user's rows are a slice, not a full scan
+    user_df = user_index.rows(user_id) if user_index is not None else df[df['UserID'] == user_id]
     top_volume, top_value = top_merchants(user_df, top_n=top_n)
     return top_volume, top_value
 
 # 6. Transaction Frequency per User
+@instrumented
 def transaction_frequency(df):
-    txn_count = df.groupby('UserID').size().reset_index(name='Transaction_Count')
-    avg_txn_value = df.groupby('UserID')['TXN_AMOUNT'].mean().reset_index(name='Average_Transaction_Value')
+    df = _float64_money(df)
+    if _is_rollup(df):
+        totals = df.groupby('UserID', observed=True)[['Txn_Count', 'TXN_AMOUNT']].sum()
+        return pd.DataFrame({
+            'UserID': totals.index,
+            'Transaction_Count': totals['Txn_Count'].to_numpy(),
+            'Average_Transaction_Value': (totals['TXN_AMOUNT'] / totals['Txn_Count']).to_numpy()
+        })
+
+    txn_count = df.groupby('UserID', observed=True).size().reset_index(name='Transaction_Count')
+    avg_txn_value = df.groupby('UserID', observed=True)['TXN_AMOUNT'].mean().reset_index(name='Average_Transaction_Value')
     frequency_df = pd.merge(txn_count, avg_txn_value, on='UserID')
     return frequency_df
 
 # 7. Daily, Weekly, Monthly Spend Trends
+@instrumented
 def temporal_spend_trends(df):
+    df = _float64_money(df)
     daily_spend = df.groupby(df['TXN_DATE'].dt.date)['TXN_AMOUNT'].sum().reset_index(name='Daily_Spend')
     weekly_spend = df.groupby(df['TXN_DATE'].dt.isocalendar().week)['TXN_AMOUNT'].sum().reset_index(name='Weekly_Spend')
     monthly_spend = df.groupby(df['TXN_DATE'].dt.to_period('M'))['TXN_AMOUNT'].sum().reset_index(name='Monthly_Spend')
     return daily_spend, weekly_spend, monthly_spend
 
 # 8. Weekday vs Weekend Spend
+@instrumented
 def weekday_vs_weekend_spend(df):
+    df = _float64_money(df)
     weekday_spend = df.groupby('Weekend')['TXN_AMOUNT'].sum().reset_index()
     weekday_spend['Day_Type'] = weekday_spend['Weekend'].map({0: 'Weekday', 1: 'Weekend'})
     return weekday_spend[['Day_Type', 'TXN_AMOUNT']]
 
 # 9. Peak Spending Hours
+@instrumented
 def peak_spending_hours(df):
+    df = _float64_money(df)
     hourly_spend = df.groupby('Hour')['TXN_AMOUNT'].sum().reset_index()
     hourly_spend.rename(columns={'TXN_AMOUNT': 'Total_Spend'}, inplace=True)
     return hourly_spend
 
 # 10. Currency Breakdown
+@instrumented
 def currency_spend_breakdown(df):
+    df = _float64_money(df)
     if 'CURRENCY' in df.columns:
-        currency_spend = df.groupby('CURRENCY')['TXN_AMOUNT'].sum().reset_index()
+        currency_spend = df.groupby('CURRENCY', observed=True)['TXN_AMOUNT'].sum().reset_index()
         currency_spend.rename(columns={'TXN_AMOUNT': 'Total_Spend'}, inplace=True)
         return currency_spend
     else:
         return pd.DataFrame()
 
 # 11. Fee Analysis
+@instrumented
 def fee_analysis(df):
+    df = _float64_money(df)
     total_fees = df['FEE_AMOUNT'].sum()
-    avg_fee_ratio = df['Fee_to_Txn_Ratio'].mean()
+    if _is_rollup(df):
+        ratio_count = df['Fee_Ratio_Count'].sum()
+        avg_fee_ratio = df['Fee_Ratio_Sum'].sum() / ratio_count if ratio_count else np.nan
+    else:
+        avg_fee_ratio = df['Fee_to_Txn_Ratio'].mean()
     return total_fees, avg_fee_ratio
 
 # 12. Rolling Spend Analysis (7-day Moving Average)
+@instrumented
 def calculate_rolling_spend(df, window=7):
-    df_sorted = df.sort_values(['UserID', 'TXN_DATE'])
+    rolling = rolling_window_features(df, windows=[f'{window}D'], aggs=('mean',), include_ties=False)
     rolling_spend = (
-        df_sorted.groupby('UserID')
-        .apply(lambda group: group.set_index('TXN_DATE')['TXN_AMOUNT'].rolling(window=f'{window}D').mean())
-        .reset_index()
-        .rename(columns={'TXN_AMOUNT': f'Rolling_{window}D_Avg_Spend'})
+        df[['UserID', 'TXN_DATE']]
+        .join(rolling)
+        .dropna(subset=['UserID'])
+        .sort_values(['UserID', 'TXN_DATE'], kind='mergesort')
+        .reset_index(drop=True)
     )
     return rolling_spend
 
 # 13. Recurring Payment Detection (Every ~30 Days)
-def detect_recurring_payments(df, interval_days=30):
-    df_sorted = df.sort_values(['UserID', 'MERC_TXN_ID', 'TXN_DATE'])
-    recurring_flags = []
-
-    for (user, merchant), group in df_sorted.groupby(['UserID', 'MERC_TXN_ID']):
-        group = group.sort_values('TXN_DATE')
-        if len(group) < 3:
-            continue  # Need at least 3 transactions to detect pattern
-        gaps = group['TXN_DATE'].diff().dt.days.dropna()
-        avg_gap = gaps.mean()
-        if abs(avg_gap - interval_days) <= 5:  # Allow 5-day margin
-            recurring_flags.append({'UserID': user, 'MERC_TXN_ID': merchant, 'Avg_Days_Between_Txns': avg_gap})
-
-    recurring_df = pd.DataFrame(recurring_flags)
+RECURRING_INTERVALS = {'Weekly': 7, 'Monthly': 30, 'Quarterly': 91}
+
+@instrumented
+def detect_recurring_payments(df, interval_days=30, tolerance_days=5):
+    """
+    Flag (UserID, MERC_TXN_ID) pairs with at least 3 transactions whose mean
+    gap in whole days is within tolerance_days of a target interval.
+
+    interval_days is one interval, a list of them, or a {label: days} dict
+    such as RECURRING_INTERVALS to test several at once; each pair is
+    matched to the nearest interval in tolerance (tolerance_days may be a
+    list aligned with the intervals). Gaps come from one lexsort of the
+    whole population and per-pair bincount sums, with no Python loop.
+
+    Confidence (0-1) is the product of how close the mean gap is to the
+    interval, how regular the gaps are (1 - std / interval, floored at 0)
+    and a sample-size factor gaps / (gaps + 2).
+    """
+    labels = list(interval_days) if isinstance(interval_days, dict) else None
+    intervals = np.atleast_1d(np.asarray(list(interval_days.values()) if labels else interval_days, dtype=float))
+    tolerances = np.broadcast_to(np.asarray(tolerance_days, dtype=float), intervals.shape)
+
+    user_codes, users = pd.factorize(df['UserID'], sort=True)
+    merchant_codes, merchants = pd.factorize(df['MERC_TXN_ID'], sort=True)
+    times = df['TXN_DATE'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    # Missing keys are left out, like groupby's default dropna
+    keep = (user_codes >= 0) & (merchant_codes >= 0)
+    user_codes, merchant_codes, times = user_codes[keep], merchant_codes[keep], times[keep]
+    order = np.lexsort((times, merchant_codes, user_codes))
+    user_codes, merchant_codes, times = user_codes[order], merchant_codes[order], times[order]
+
+    new_pair = np.ones(len(order), dtype=bool)
+    new_pair[1:] = (user_codes[1:] != user_codes[:-1]) | (merchant_codes[1:] != merchant_codes[:-1])
+    pair_ids = np.cumsum(new_pair) - 1
+    n_pairs = int(pair_ids[-1]) + 1 if len(pair_ids) else 0
+
+    # Gaps in whole days (like .dt.days) between consecutive rows of a pair
+    gap_rows = ~new_pair
+    gaps = np.diff(times, prepend=times[:1]) // pd.Timedelta(days=1).value
+    gap_pairs = pair_ids[gap_rows]
+    gaps = gaps[gap_rows].astype(float)
+
+    gap_count = np.bincount(gap_pairs, minlength=n_pairs)
+    gap_sum = np.bincount(gap_pairs, weights=gaps, minlength=n_pairs)
+    gap_sq_sum = np.bincount(gap_pairs, weights=gaps ** 2, minlength=n_pairs)
+
+    candidates = np.flatnonzero(gap_count >= 2)  # at least 3 transactions
+    count = gap_count[candidates]
+    avg_gap = gap_sum[candidates] / count
+    gap_std = np.sqrt(np.maximum(gap_sq_sum[candidates] - gap_sum[candidates] * avg_gap, 0) / (count - 1))
+
+    # Nearest target interval within its tolerance
+    distance = np.abs(avg_gap[:, None] - intervals[None, :])
+    distance[distance > tolerances[None, :]] = np.inf
+    best = distance.argmin(axis=1)
+    matched = np.isfinite(distance[np.arange(len(candidates)), best])
+
+    candidates, count, avg_gap, gap_std, best = (
+        candidates[matched], count[matched], avg_gap[matched], gap_std[matched], best[matched])
+    interval = intervals[best]
+
+    closeness = np.clip(1 - np.abs(avg_gap - interval) / interval, 0, 1)
+    regularity = np.clip(1 - gap_std / interval, 0, 1)
+    confidence = closeness * regularity * count / (count + 2)
+
+    first_rows = np.flatnonzero(new_pair)[candidates]
+    recurring_df = pd.DataFrame({
+        'UserID': users.take(user_codes[first_rows]),
+        'MERC_TXN_ID': merchants.take(merchant_codes[first_rows]),
+        'Avg_Days_Between_Txns': avg_gap,
+        'Txn_Count': count + 1,
+        'Gap_Std_Days': gap_std,
+        'Interval_Days': interval,
+        'Confidence': confidence.round(3)
+    })
+    if labels:
+        recurring_df.insert(recurring_df.columns.get_loc('Interval_Days'), 'Interval', np.array(labels)[best])
     return recurring_df
 
 # 14. User Segmentation (Gold/Silver/Bronze)
+@instrumented
 def segment_users(total_spend_df):
     spend_quantiles = total_spend_df['Total_Spend'].quantile([0.2, 0.7]).values
 
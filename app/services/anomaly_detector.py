@@ -1,100 +1,364 @@
+import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.ensemble import IsolationForest
+from app.services.instrumentation import instrumented
 
-def detect_outliers(df, contamination=0.01):
+def _user_positions(df, user_index=None):
+    """
+    Row positions of each user, in groupby('UserID') order with rows kept in
+    frame order, built from one factorize + stable argsort, or read
+    straight from a UserIndex built on this frame.
+    """
+    if user_index is not None:
+        return user_index.positions()
+
+    codes, _ = pd.factorize(df['UserID'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0])
+    order = order[len(order) - counts.sum():]  # missing UserIDs (-1) sort first
+    return np.split(order, np.cumsum(counts)[:-1]) if len(counts) else []
+
+@instrumented
+def _fit_predict_users(amount_arrays, contamination, random_state):
+    masks = []
+    for amounts in amount_arrays:
+        amounts = amounts.reshape(-1, 1)
+        model = IsolationForest(contamination=contamination, random_state=random_state)
+        model.fit(amounts)
+        masks.append(model.predict(amounts) == -1)
+    return masks
+
+@instrumented
+def _outlier_positions(df, contamination, n_jobs, users_per_task, random_state, user_index=None):
+    positions = [pos for pos in _user_positions(df, user_index) if len(pos) >= 10]
+    if not positions:
+        return None
+
+    amounts = df['TXN_AMOUNT'].to_numpy()
+    tasks = [
+        [amounts[pos] for pos in positions[start:start + users_per_task]]
+        for start in range(0, len(positions), users_per_task)
+    ]
+
+    if n_jobs in (None, -1):
+        n_jobs = os.cpu_count()
+
+    if n_jobs == 1 or len(tasks) == 1:
+        results = [_fit_predict_users(task, contamination, random_state) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_fit_predict_users, tasks,
+                                    [contamination] * len(tasks), [random_state] * len(tasks)))
+
+    masks = [mask for task_masks in results for mask in task_masks]
+    return np.concatenate([pos[mask] for pos, mask in zip(positions, masks)])
+
+@instrumented
+def detect_outliers(df, contamination=0.01, n_jobs=1, users_per_task=64, random_state=42, user_index=None):
     """
     Detect outliers per user using Isolation Forest.
     Adds Anomaly_Type column = 'Outlier'.
+
+    Fits run on NumPy arrays; with n_jobs > 1 (or None / -1 for every core)
+    users are fanned out over a process pool, users_per_task at a time.
+    Results are identical to the serial path for a fixed random_state.
+    Pass the frame's UserIndex (load_and_clean_data(..., with_index=True))
+    to skip regrouping the rows by user.
     """
-    outlier_records = []
+    outlier_positions = _outlier_positions(df, contamination, n_jobs, users_per_task, random_state, user_index)
+    if outlier_positions is None:
+        return pd.DataFrame()
 
-    for user_id, user_df in df.groupby('UserID'):
-        if len(user_df) < 10:
-            continue
+    outlier_txns = df.iloc[outlier_positions].copy()
+    outlier_txns['Anomaly_Type'] = 'Outlier'
+    return outlier_txns
+
+@instrumented
+def outlier_mask(df, contamination=0.01, n_jobs=1, users_per_task=64, random_state=42, user_index=None):
+    """
+    Row-aligned boolean version of detect_outliers().
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    outlier_positions = _outlier_positions(df, contamination, n_jobs, users_per_task, random_state, user_index)
+    if outlier_positions is not None:
+        mask[outlier_positions] = True
+    return pd.Series(mask, index=df.index, name='Outlier')
 
-        model = IsolationForest(contamination=contamination, random_state=42)
-        user_txn_amounts = user_df[['TXN_AMOUNT']]
-        model.fit(user_txn_amounts)
-        preds = model.predict(user_txn_amounts)
+@instrumented
+def spending_spike_thresholds(df, percentile_thresholds=(95,)):
+    """
+    Each user's TXN_AMOUNT percentiles, one column per threshold.
 
-        user_df = user_df.copy()
-        user_df['Anomaly_Type'] = None
-        user_df.loc[preds == -1, 'Anomaly_Type'] = 'Outlier'
+    Users are bucketed by transaction count and every bucket is reduced
+    with a single np.quantile call along axis 1, so the work scales with the
+    number of distinct history lengths rather than the number of users, and
+    values match Series.quantile exactly.
+    """
+    percentile_thresholds = list(percentile_thresholds)
+    codes, uniques = pd.factorize(df['UserID'], sort=True)
+    amounts = df['TXN_AMOUNT'].to_numpy()
+    if amounts.dtype.kind in 'iub':
+        amounts = amounts.astype(float)
 
-        outlier_txns = user_df[user_df['Anomaly_Type'].notnull()]
-        outlier_records.append(outlier_txns)
+    # quantile() skips NaN amounts
+    valid = np.flatnonzero((codes >= 0) & ~np.isnan(amounts))
+    valid = valid[np.argsort(codes[valid], kind='stable')]
+    counts = np.bincount(codes[valid], minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
 
-    return pd.concat(outlier_records) if outlier_records else pd.DataFrame()
+    qs = np.array([p / 100 for p in percentile_thresholds])
+    thresholds = np.full((len(uniques), len(qs)), np.nan)
+    for size in np.unique(counts[counts > 0]):
+        users = np.flatnonzero(counts == size)
+        block = amounts[valid[starts[users][:, None] + np.arange(size)]]
+        thresholds[users] = np.quantile(block, qs, axis=1).T
 
-def detect_spending_spikes(df, percentile_threshold=95):
+    return pd.DataFrame(thresholds, index=pd.Index(uniques, name='UserID'), columns=percentile_thresholds)
+
+@instrumented
+def spending_spike_mask(df, percentile_thresholds=(90, 95, 99)):
+    """
+    Row-aligned spike flags for several percentile tiers in one pass.
+
+    Returns a boolean DataFrame indexed like df with one column per
+    percentile; a row is True when TXN_AMOUNT >= its user's threshold.
+    """
+    percentile_thresholds = list(percentile_thresholds)
+    thresholds = spending_spike_thresholds(df, percentile_thresholds).to_numpy()
+    codes, _ = pd.factorize(df['UserID'], sort=True)
+    amounts = df['TXN_AMOUNT'].to_numpy()
+
+    mask = np.zeros((len(df), len(percentile_thresholds)), dtype=bool)
+    known = codes >= 0
+    with np.errstate(invalid='ignore'):
+        mask[known] = amounts[known, None] >= thresholds[codes[known]]
+    return pd.DataFrame(mask, index=df.index, columns=percentile_thresholds)
+
+@instrumented
+def detect_spending_spikes(df, percentile_threshold=95, user_index=None):
     """
     Detect spending spikes above user's 95th percentile.
     Adds Anomaly_Type column = 'Spending Spike'.
     """
-    spike_records = []
+    positions = _user_positions(df, user_index)
+    if not positions:
+        return pd.DataFrame()
+
+    mask = spending_spike_mask(df, [percentile_threshold])[percentile_threshold].to_numpy()
+    ordered = np.concatenate(positions)
+
+    spike_txns = df.iloc[ordered[mask[ordered]]].copy()
+    spike_txns['Anomaly_Type'] = 'Spending Spike'
+    return spike_txns
 
-    for user_id, user_df in df.groupby('UserID'):
-        threshold = user_df['TXN_AMOUNT'].quantile(percentile_threshold / 100)
-        spike_txns = user_df[user_df['TXN_AMOUNT'] >= threshold].copy()
-        spike_txns['Anomaly_Type'] = 'Spending Spike'
-        spike_records.append(spike_txns)
+DUPLICATE_KEYS = ['UserID', 'MERC_TXN_ID', 'TXN_AMOUNT']
 
-    return pd.concat(spike_records) if spike_records else pd.DataFrame()
+# Default duplicate window of the detectors, dashboard, batch job and stream scorer
+DUPLICATE_WINDOW = '60s'
 
-def detect_duplicates(df, round_to=None):
+@instrumented
+def duplicate_clusters(df, window=DUPLICATE_WINDOW):
     """
-    Detect duplicate transactions based on UserID + TXN_DATE + MERC_TXN_ID + TXN_AMOUNT.
-    Adds Anomaly_Type = 'Duplicate Transaction'.
-    
-    Optional: round TXN_DATE to 'hour' or 'minute' to catch near-duplicates.
+    Cluster transactions with the same UserID + MERC_TXN_ID + TXN_AMOUNT whose
+    TXN_DATEs are within `window` of each other (chained: each charge within
+    the window of the previous one).
+
+    One lexsort on integer key codes plus a neighbour-diff sweep, O(n log n),
+    without copying the input. Returns an integer Series aligned to df:
+    the cluster ID for duplicates, -1 for everything else.
     """
-    df_copy = df.copy()
+    width = pd.Timedelta(window).value
+    codes = [pd.factorize(df[col], use_na_sentinel=False)[0] for col in DUPLICATE_KEYS]
+    times = df['TXN_DATE'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    order = np.lexsort((times, *reversed(codes)))
+    times = times[order]
+
+    # A row joins the previous row's cluster when the key matches and the gap fits
+    linked = np.zeros(len(order), dtype=bool)
+    if len(order) > 1:
+        linked[1:] = np.diff(times) <= width
+        for key_codes in codes:
+            sorted_codes = key_codes[order]
+            linked[1:] &= sorted_codes[1:] == sorted_codes[:-1]
+
+    cluster = np.cumsum(~linked) - 1
+    is_duplicate = np.bincount(cluster)[cluster] > 1
+
+    # Renumber so duplicate clusters are 0..k-1 in sorted order
+    cluster_ids = np.full(len(order), -1, dtype=np.int64)
+    kept = np.unique(cluster[is_duplicate], return_inverse=True)[1]
+    cluster_ids[is_duplicate] = kept
+
+    result = np.empty(len(order), dtype=np.int64)
+    result[order] = cluster_ids
+    return pd.Series(result, index=df.index, name='Duplicate_Cluster')
 
+def _rounded_dates(df, round_to):
+    txn_dates = df['TXN_DATE']
     if round_to == 'hour':
-        df_copy['TXN_DATE'] = pd.to_datetime(df_copy['TXN_DATE']).dt.round('H')
+        txn_dates = pd.to_datetime(txn_dates).dt.round('h')
     elif round_to == 'minute':
-        df_copy['TXN_DATE'] = pd.to_datetime(df_copy['TXN_DATE']).dt.round('min')
+        txn_dates = pd.to_datetime(txn_dates).dt.round('min')
+    return txn_dates
 
-    duplicate_mask = df_copy.duplicated(subset=['UserID', 'TXN_DATE', 'MERC_TXN_ID', 'TXN_AMOUNT'], keep=False)
-    dupes = df_copy[duplicate_mask].copy()
+@instrumented
+def duplicate_mask(df, round_to=None, window=None):
+    """
+    Row-aligned boolean version of detect_duplicates().
+    """
+    if window is not None:
+        return (duplicate_clusters(df, window) >= 0).rename('Duplicate')
+
+    keys = pd.DataFrame({
+        'UserID': df['UserID'],
+        'TXN_DATE': _rounded_dates(df, round_to),
+        'MERC_TXN_ID': df['MERC_TXN_ID'],
+        'TXN_AMOUNT': df['TXN_AMOUNT']
+    })
+    return keys.duplicated(keep=False).rename('Duplicate')
+
+@instrumented
+def detect_duplicates(df, round_to=None, window=None):
+    """
+    Detect duplicate transactions based on UserID + TXN_DATE + MERC_TXN_ID + TXN_AMOUNT.
+    Adds Anomaly_Type = 'Duplicate Transaction'.
+
+    Pass window (e.g. DUPLICATE_WINDOW, '60s') to match charges within that
+    time of each other; this also adds a Duplicate_Cluster column grouping
+    the copies.
+    Legacy option: round TXN_DATE to 'hour' or 'minute' instead, which
+    misses pairs that straddle a rounding boundary.
+    """
+    if window is not None:
+        clusters = duplicate_clusters(df, window)
+        mask = (clusters >= 0).to_numpy()
+        dupes = df[mask].copy()
+        dupes['Duplicate_Cluster'] = clusters[mask]
+        dupes['Anomaly_Type'] = 'Duplicate Transaction'
+        return dupes
+
+    mask = duplicate_mask(df, round_to).to_numpy()
+    dupes = df[mask].copy()
+    if round_to is not None:
+        dupes['TXN_DATE'] = _rounded_dates(dupes, round_to)
     dupes['Anomaly_Type'] = 'Duplicate Transaction'
 
     return dupes
 
+# Bit per anomaly type; a transaction's Anomaly_Flags is the OR of its types
+ANOMALY_FLAGS = {
+    'Outlier': 1,
+    'Spending Spike': 2,
+    'Duplicate Transaction': 4
+}
+
+ANOMALY_COLUMNS = ['UserID', 'TXN_AMOUNT', 'MERC_TXN_ID', 'TXN_DATE']
+
+# Anomaly tables are listed in this key order (as the original groupby did)
+ANOMALY_SORT_KEYS = ['UserID', 'TXN_DATE', 'TXN_AMOUNT', 'MERC_TXN_ID']
+
+def sort_anomalies(anomalies):
+    keys = [key for key in ANOMALY_SORT_KEYS if key in anomalies.columns]
+    return anomalies.sort_values(keys, kind='mergesort').reset_index(drop=True)
+
+@instrumented
+def anomaly_flags(df, outliers=None, spikes=None, duplicates=None):
+    """
+    Combine detector results into one integer Anomaly_Flags Series aligned
+    to df, using the ANOMALY_FLAGS bits.
+
+    Each argument is a boolean mask aligned to df (outlier_mask,
+    spending_spike_mask, duplicate_mask) or a detector's output frame,
+    matched on df's index.
+    """
+    flags = np.zeros(len(df), dtype=np.int8)
+    found = {'Outlier': outliers, 'Spending Spike': spikes, 'Duplicate Transaction': duplicates}
+    for anomaly_type, result in found.items():
+        if result is None:
+            continue
+        if isinstance(result, pd.DataFrame):
+            hit = df.index.isin(result.index)
+        else:
+            hit = np.asarray(result, dtype=bool)
+        flags[hit] |= ANOMALY_FLAGS[anomaly_type]
+    return pd.Series(flags, index=df.index, name='Anomaly_Flags')
+
+def anomaly_labels(flags):
+    """
+    Render Anomaly_Flags as 'Outlier; Spending Spike' style labels. Only the
+    distinct flag values are formatted, then mapped onto the rows.
+    """
+    flags = pd.Series(flags)
+    labels = {
+        value: '; '.join(name for name, bit in sorted(ANOMALY_FLAGS.items()) if value & bit)
+        for value in flags.unique()
+    }
+    return flags.map(labels).rename('Anomaly_Type')
+
+@instrumented
+def flagged_anomalies(df, flags, columns=ANOMALY_COLUMNS):
+    """
+    The flagged rows of df (selected columns only), with Anomaly_Type and
+    Anomaly_Flags - the same layout merge_anomalies returns. Rows stay in
+    df's order; sort_anomalies() gives merge_anomalies' order.
+    """
+    hit = (flags > 0).to_numpy()
+    anomalies = df.loc[hit, [col for col in columns if col in df.columns]]
+    anomalies.insert(0, 'Anomaly_Type', anomaly_labels(flags[hit]).to_numpy())
+    anomalies['Anomaly_Flags'] = flags[hit].to_numpy()
+    return anomalies.reset_index(drop=True)
+
+@instrumented
 def merge_anomalies(outliers, spikes, duplicates):
-    all_anomalies = pd.concat([outliers, spikes, duplicates], ignore_index=True)
-    all_anomalies = all_anomalies[all_anomalies['Anomaly_Type'].notnull()]
-    required_cols = ['UserID', 'TXN_DATE', 'TXN_AMOUNT', 'MERC_TXN_ID', 'Anomaly_Type']
-    for col in required_cols:
-        if col not in all_anomalies.columns:
-            all_anomalies[col] = None
-    group_keys = ['UserID', 'TXN_DATE', 'TXN_AMOUNT', 'MERC_TXN_ID']
-    merged = all_anomalies.groupby(group_keys, dropna=False).agg({
-        'Anomaly_Type': lambda x: '; '.join(sorted(set(i for i in x if pd.notnull(i)))),
-        'UserID': 'first',
-        'TXN_AMOUNT': 'first',
-        'MERC_TXN_ID': 'first',
-        'TXN_DATE': 'first'
-    }).reset_index(drop=True)
-
-    return merged
+    """
+    One row per flagged transaction from detector frames taken from the
+    same source frame. Rows are matched on that frame's index and their
+    types OR-ed into Anomaly_Flags, so there is no key-column groupby.
+    Rows are sorted by UserID, TXN_DATE, TXN_AMOUNT and MERC_TXN_ID.
+    """
+    found = {'Outlier': outliers, 'Spending Spike': spikes, 'Duplicate Transaction': duplicates}
+    found = {name: result for name, result in found.items() if not result.empty}
+    if not found:
+        return pd.DataFrame(columns=['Anomaly_Type'] + ANOMALY_COLUMNS + ['Anomaly_Flags'])
+
+    rows = pd.concat([result.reindex(columns=ANOMALY_COLUMNS) for result in found.values()])
+    bits = np.concatenate([np.full(len(result), ANOMALY_FLAGS[name], dtype=np.int8)
+                           for name, result in found.items()])
+
+    codes, _ = pd.factorize(rows.index)
+    flags = np.zeros(codes.max() + 1, dtype=np.int8)
+    np.bitwise_or.at(flags, codes, bits)
 
+    # factorize numbers rows by first appearance, matching the first-occurrence rows
+    merged = rows[~rows.index.duplicated()]
+    merged.insert(0, 'Anomaly_Type', anomaly_labels(flags).to_numpy())
+    merged['Anomaly_Flags'] = flags
+    if 'Duplicate_Cluster' in duplicates.columns:
+        merged['Duplicate_Cluster'] = duplicates['Duplicate_Cluster'].reindex(merged.index).to_numpy()
+
+    return sort_anomalies(merged)
+
+@instrumented
 def summarize_anomalies(merged_anomalies):
     """
     Returns count of anomaly types per user in clean summary form.
-    
-    Output: DataFrame with columns: UserID | Anomaly_Type | Count
-    """
-    exploded = merged_anomalies.copy()
 
-    # Handle stacked anomaly types by splitting them
-    exploded['Anomaly_Type'] = exploded['Anomaly_Type'].str.split('; ')
-    exploded = exploded.explode('Anomaly_Type')
+    Counted from the Anomaly_Flags bits, one vectorized column per type.
+    Output: DataFrame with columns: UserID | Anomaly_Type | Anomaly_Count
+    """
+    flags = merged_anomalies['Anomaly_Flags'].to_numpy()
+    hits = pd.DataFrame({name: (flags & bit) > 0 for name, bit in sorted(ANOMALY_FLAGS.items())})
+    hits['UserID'] = merged_anomalies['UserID'].to_numpy()
 
     summary = (
-        exploded.groupby(['UserID', 'Anomaly_Type'])
-        .size()
+        hits.groupby('UserID')
+        .sum()
+        .rename_axis(columns='Anomaly_Type')
+        .stack()
         .reset_index(name='Anomaly_Count')
     )
 
-    return summary
\ No newline at end of file
+    return summary[summary['Anomaly_Count'] > 0].reset_index(drop=True)
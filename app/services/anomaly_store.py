@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import pandas as pd
+from app.services.instrumentation import instrumented
+
+# Same layout as merge_anomalies()
+STORE_COLUMNS = ['Anomaly_Type', 'UserID', 'TXN_AMOUNT', 'MERC_TXN_ID', 'TXN_DATE', 'Anomaly_Flags',
+                 'Duplicate_Cluster']
+
+# ISO text sorts like the timestamp, so range queries can use the index
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+class AnomalyStore:
+    """
+    SQLite table of precomputed anomalies, indexed on (UserID, TXN_DATE).
+
+    A batch job fills it with write(); the dashboard reads one user's
+    rows for a date range with query() and only runs detection for
+    transactions newer than watermark().
+    """
+
+    def __init__(self, db_path='outputs/anomalies.db'):
+        self.db_path = db_path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS anomalies (
+                Anomaly_Type TEXT,
+                UserID TEXT NOT NULL,
+                TXN_AMOUNT REAL,
+                MERC_TXN_ID TEXT,
+                TXN_DATE TEXT NOT NULL,
+                Anomaly_Flags INTEGER,
+                Duplicate_Cluster REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_anomalies_user_date ON anomalies (UserID, TXN_DATE)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return conn
+
+    def watermark(self):
+        """
+        Latest TXN_DATE covered by the last batch run, or None if the store
+        has never been filled.
+        """
+        if not os.path.exists(self.db_path):
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'watermark'").fetchone()
+        finally:
+            conn.close()
+        return pd.Timestamp(row[0]) if row else None
+
+    @instrumented
+    def write(self, anomalies, watermark, replace=True):
+        """
+        Store merged anomalies (merge_anomalies / flagged_anomalies layout)
+        scored on all data up to `watermark`. replace=True swaps out the
+        whole table in one transaction, so readers never see a partial run.
+        """
+        rows = anomalies.reindex(columns=STORE_COLUMNS)
+        rows = rows.astype({'UserID': object, 'MERC_TXN_ID': object, 'Anomaly_Type': object})
+        rows['TXN_DATE'] = pd.to_datetime(rows['TXN_DATE']).dt.strftime(DATE_FORMAT)
+
+        conn = self._connect()
+        try:
+            with conn:
+                if replace:
+                    conn.execute("DELETE FROM anomalies")
+                rows.to_sql('anomalies', conn, if_exists='append', index=False)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('watermark', ?)",
+                             (pd.Timestamp(watermark).isoformat(),))
+        finally:
+            conn.close()
+
+    @instrumented
+    def query(self, user_id, start=None, end=None):
+        """
+        One user's stored anomalies with start <= TXN_DATE <= end (either
+        bound optional), ordered by TXN_DATE.
+        """
+        sql = f"SELECT {', '.join(STORE_COLUMNS)} FROM anomalies WHERE UserID = ?"
+        params = [str(user_id)]
+        if start is not None:
+            sql += " AND TXN_DATE >= ?"
+            params.append(pd.Timestamp(start).strftime(DATE_FORMAT))
+        if end is not None:
+            sql += " AND TXN_DATE <= ?"
+            params.append(pd.Timestamp(end).strftime(DATE_FORMAT))
+        sql += " ORDER BY TXN_DATE"
+
+        conn = self._connect()
+        try:
+            anomalies = pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+        anomalies['TXN_DATE'] = pd.to_datetime(anomalies['TXN_DATE'], format=DATE_FORMAT)
+        return anomalies
@@ -0,0 +1,266 @@
+import os
+import json
+import glob
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app.services.data_loader import load_and_clean_data, source_fingerprint
+from app.services.anomaly_store import AnomalyStore
+from app.services.anomaly_detector import (
+    DUPLICATE_WINDOW,
+    detect_duplicates,
+    detect_outliers,
+    detect_spending_spikes,
+    merge_anomalies
+)
+from app.services.instrumentation import instrumented
+
+STAGES = ('outliers', 'spikes', 'duplicates', 'merge', 'write')
+
+def _shard_ids(user_ids, shards):
+    """
+    Stable shard number per UserID (same user -> same shard on every run),
+    so a resumed job skips exactly the users it finished before.
+    """
+    users = pd.Series(pd.unique(user_ids)).astype(str)
+    hashed = pd.util.hash_pandas_object(users, index=False).to_numpy()
+    return dict(zip(users, hashed % shards))
+
+def _done_marker(output_dir, shard):
+    return os.path.join(output_dir, '_done', f"shard-{shard:05d}")
+
+def _finished_shards(output_dir, run):
+    """
+    Shards an earlier run finished, for resume. Every done marker must come
+    from a run with the same source fingerprint, shard count and detector
+    settings; otherwise users would map to other shards (or keep stale
+    results), so resuming is refused.
+    """
+    finished = set()
+    for marker in glob.glob(os.path.join(output_dir, '_done', 'shard-*')):
+        with open(marker) as f:
+            done = json.load(f)
+        changed = [key for key, value in run.items() if done.get(key) != value]
+        if changed:
+            raise ValueError(f"Cannot resume: {output_dir} was scored with different {', '.join(changed)}. "
+                             "Run again without resume.")
+        finished.add(int(os.path.basename(marker).split('-')[1]))
+    return finished
+
+@instrumented
+def _score_shard(shard, run, df, output_dir):
+    """
+    Run every detector on one shard's users and write its anomalies under
+    YearMonth=YYYY-MM/shard-NNNNN.parquet. The done marker (recording `run`,
+    see _finished_shards) is written last, so a crashed shard is redone (and
+    its files overwritten) on resume.
+    """
+    shards = run['shards']
+    duplicate_window = run['duplicate_window']
+    percentile_threshold = run['percentile_threshold']
+    timings = {}
+
+    started = time.perf_counter()
+    outliers = detect_outliers(df)
+    timings['outliers'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    spikes = detect_spending_spikes(df, percentile_threshold)
+    timings['spikes'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    duplicates = detect_duplicates(df, window=duplicate_window)
+    timings['duplicates'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    anomalies = merge_anomalies(outliers, spikes, duplicates)
+    if 'Duplicate_Cluster' in anomalies.columns:
+        # Cluster IDs restart in every shard; interleave them so they stay unique
+        anomalies['Duplicate_Cluster'] = anomalies['Duplicate_Cluster'] * shards + shard
+    timings['merge'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if not anomalies.empty:
+        months = anomalies['TXN_DATE'].dt.strftime('%Y-%m')
+        for month, part in anomalies.groupby(months.to_numpy()):
+            partition_dir = os.path.join(output_dir, f"YearMonth={month}")
+            os.makedirs(partition_dir, exist_ok=True)
+            part_file = os.path.join(partition_dir, f"shard-{shard:05d}.parquet")
+            part.to_parquet(part_file + '.tmp', index=False)
+            os.replace(part_file + '.tmp', part_file)
+
+    marker = _done_marker(output_dir, shard)
+    with open(marker, 'w') as f:
+        json.dump({**run, 'rows': len(df), 'anomalies': len(anomalies)}, f)
+    timings['write'] = time.perf_counter() - started
+
+    return {
+        'shard': shard,
+        'rows': len(df),
+        'users': df['UserID'].nunique(),
+        'anomalies': len(anomalies),
+        'timings': timings
+    }
+
+def _clear_output(output_dir):
+    # Only remove what this job writes, never the rest of output_dir
+    for path in glob.glob(os.path.join(output_dir, 'YearMonth=*', 'shard-*.parquet*')):
+        os.remove(path)
+    for path in glob.glob(os.path.join(output_dir, '_done', 'shard-*')):
+        os.remove(path)
+
+@instrumented
+def score_population(file_path, output_dir='outputs/anomalies', workers=1, shards=16, resume=False,
+                     cache_dir='outputs/cache', profile='full', duplicate_window=DUPLICATE_WINDOW,
+                     percentile_threshold=95, store_path=None):
+    """
+    Precompute anomalies for every user and write them as a partitioned
+    parquet dataset (one YearMonth=YYYY-MM directory per month).
+
+    Users are split into `shards` stable hash shards, each scored
+    independently by one of `workers` processes; every detector only looks
+    within a user, so shard results match a single whole-frame run. With
+    resume=True, shards finished by an earlier run are skipped; this raises
+    ValueError if that run used another source (size / mtime fingerprint),
+    shard count, profile or detector settings. With
+    store_path, the finished dataset is also loaded into an AnomalyStore
+    (SQLite) for the dashboard, watermarked at the latest TXN_DATE scored.
+
+    Prints progress per shard and returns the throughput report (also
+    saved as run_report.json in output_dir).
+    """
+    job_started = time.perf_counter()
+    run = {
+        'source': source_fingerprint(file_path),
+        'shards': shards,
+        'profile': profile,
+        'duplicate_window': duplicate_window,
+        'percentile_threshold': percentile_threshold
+    }
+    # Check before the (long) load so a mismatched resume fails fast
+    finished = _finished_shards(output_dir, run) if resume else set()
+
+    started = time.perf_counter()
+    df = load_and_clean_data(file_path, cache_dir=cache_dir, profile=profile, workers=workers)
+    load_seconds = time.perf_counter() - started
+
+    os.makedirs(os.path.join(output_dir, '_done'), exist_ok=True)
+    if not resume:
+        _clear_output(output_dir)
+
+    shard_of_user = _shard_ids(df['UserID'].dropna(), shards)
+    row_shards = df['UserID'].astype(str).map(shard_of_user).to_numpy()
+
+    pending = [shard for shard in range(shards) if shard not in finished]
+    skipped = shards - len(pending)
+    if skipped:
+        print(f"Resuming: {skipped} of {shards} shards already finished.")
+
+    # Rows with no UserID cannot be attributed to a user and are not scored
+    positions = {shard: np.flatnonzero(row_shards == shard) for shard in pending}
+    args = [(shard, run, df.iloc[positions[shard]], output_dir) for shard in pending]
+
+    results = []
+    started = time.perf_counter()
+
+    def report(result):
+        results.append(result)
+        seconds = sum(result['timings'].values())
+        print(f"[{len(results)}/{len(pending)}] shard {result['shard']:05d}: {result['rows']:,} rows, "
+              f"{result['users']:,} users, {result['anomalies']:,} anomalies ({seconds:.2f}s)")
+
+    if workers == 1 or len(args) <= 1:
+        for shard_args in args:
+            report(_score_shard(*shard_args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_score_shard, *shard_args) for shard_args in args]
+            for future in as_completed(futures):
+                report(future.result())
+
+    score_seconds = time.perf_counter() - started
+    rows = sum(result['rows'] for result in results)
+    users = sum(result['users'] for result in results)
+
+    run_report = {
+        'input': file_path,
+        'workers': workers,
+        'shards_scored': len(results),
+        'shards_skipped': skipped,
+        'rows': rows,
+        'users': users,
+        'anomalies': sum(result['anomalies'] for result in results),
+        'load_seconds': round(load_seconds, 3),
+        'score_seconds': round(score_seconds, 3),
+        'total_seconds': round(time.perf_counter() - job_started, 3),
+        'rows_per_second': round(rows / score_seconds, 1) if score_seconds else None,
+        'users_per_second': round(users / score_seconds, 1) if score_seconds else None,
+        # Summed over shards, i.e. worker time rather than wall-clock time
+        'stage_seconds': {
+            stage: round(sum(result['timings'][stage] for result in results), 3) for stage in STAGES
+        }
+    }
+
+    if store_path is not None:
+        started = time.perf_counter()
+        AnomalyStore(store_path).write(load_anomalies(output_dir), df['TXN_DATE'].max())
+        run_report['store_seconds'] = round(time.perf_counter() - started, 3)
+        print(f"Loaded anomalies into {store_path} in {run_report['store_seconds']:.2f}s.")
+
+    with open(os.path.join(output_dir, 'run_report.json'), 'w') as f:
+        json.dump(run_report, f, indent=4)
+
+    print(f"Scored {rows:,} rows for {users:,} users in {score_seconds:.2f}s "
+          f"({run_report['rows_per_second']} rows/s, {run_report['users_per_second']} users/s); "
+          f"load took {load_seconds:.2f}s.")
+    print("Stage time (summed over shards): " +
+          ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in run_report['stage_seconds'].items()))
+    return run_report
+
+def load_anomalies(output_dir='outputs/anomalies', months=None):
+    """
+    Read the batch job's output back as one frame, optionally only the
+    given YearMonth partitions (e.g. ['2024-07']).
+    """
+    pattern = os.path.join(output_dir, 'YearMonth=*', 'shard-*.parquet')
+    files = sorted(glob.glob(pattern))
+    if months is not None:
+        wanted = {f"YearMonth={month}" for month in months}
+        files = [path for path in files if os.path.basename(os.path.dirname(path)) in wanted]
+    if not files:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute anomalies for every user.")
+    parser.add_argument('--input', default='data/transactions.csv',
+                        help="CSV file, directory or glob of CSV partitions")
+    parser.add_argument('--output', default='outputs/anomalies', help="Partitioned output directory")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--shards', type=int, default=16, help="Number of user shards (units of resume)")
+    parser.add_argument('--resume', action='store_true', help="Skip shards finished by a previous run")
+    parser.add_argument('--cache-dir', default='outputs/cache', help="Cleaned data cache directory")
+    parser.add_argument('--profile', default='full', choices=['full', 'compact'])
+    parser.add_argument('--duplicate-window', default=DUPLICATE_WINDOW)
+    parser.add_argument('--percentile', type=float, default=95)
+    parser.add_argument('--store', default=None,
+                        help="Also load the results into this SQLite anomaly store (e.g. outputs/anomalies.db)")
+    args = parser.parse_args(argv)
+
+    score_population(
+        args.input,
+        output_dir=args.output,
+        workers=args.workers,
+        shards=args.shards,
+        resume=args.resume,
+        cache_dir=args.cache_dir,
+        profile=args.profile,
+        duplicate_window=args.duplicate_window,
+        percentile_threshold=args.percentile,
+        store_path=args.store
+    )
+
+if __name__ == "__main__":
+    main()
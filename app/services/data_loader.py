@@ -1,25 +1,295 @@
 import pandas as pd
+import numpy as np
 import os
 import json
+import hashlib
+import glob
+import re
+from concurrent.futures import ProcessPoolExecutor
+from app.services.rolling_features import rolling_window_features
+from app.services.instrumentation import instrumented
 
-def load_and_clean_data(file_path):
-    dtype = {
-        'UserID': str,
-        'TXN_ID': str,
-        'MERC_TXN_ID': str,
-        'TXN_TYPE': str,
-        'CURRENCY': str
-    }
+# Bump whenever the cleaning / feature engineering below changes so that
+# previously cached frames are ignored.
+CLEANING_VERSION = '3'
+
+def resolve_sources(file_path):
+    """
+    Expand a CSV path, a directory of CSVs or a glob pattern into a sorted
+    list of files.
+    """
+    if os.path.isdir(file_path):
+        return sorted(glob.glob(os.path.join(file_path, '*.csv')))
+    if glob.has_magic(file_path):
+        return sorted(glob.glob(file_path))
+    return [file_path]
+
+def source_fingerprint(file_path, hash_content=False):
+    """
+    Fingerprint a source (file, directory or glob) for cache keying.
+
+    By default uses size + mtime, which is cheap; pass hash_content=True to
+    hash the file bytes instead (robust to copies that reset mtime).
+    """
+    digest = hashlib.sha1(f"v{CLEANING_VERSION}|".encode())
+
+    for path in resolve_sources(file_path):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}|".encode())
+        if hash_content:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            digest.update(f"{stat.st_size}|{stat.st_mtime_ns}|".encode())
+
+    return digest.hexdigest()
+
+def _cache_prefix(file_path, profile):
+    if glob.has_magic(file_path):
+        # e.g. data/daily/*.csv -> data_daily_.csv
+        stem = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.normpath(file_path)).strip('_')
+    else:
+        stem = os.path.splitext(os.path.basename(os.path.normpath(file_path)))[0]
+    return f"{stem}-{profile}-"
+
+def _cache_path(file_path, cache_dir, fingerprint, profile):
+    return os.path.join(cache_dir, f"{_cache_prefix(file_path, profile)}{fingerprint[:16]}.parquet")
+
+@instrumented
+def _read_cache(cache_file):
+    try:
+        return pd.read_parquet(cache_file)
+    except ImportError:
+        print("Warning: pyarrow is not installed, skipping the cleaned data cache.")
+    except Exception as e:
+        print(f"Warning: could not read cache {cache_file} ({e}), rebuilding.")
+    return None
+
+@instrumented
+def _write_cache(df, file_path, cache_dir, cache_file, profile):
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = cache_file + '.tmp'
+    try:
+        df.to_parquet(tmp_file, index=False)
+    except ImportError:
+        print("Warning: pyarrow is not installed, skipping the cleaned data cache.")
+        return
+    except Exception as e:
+        print(f"Warning: could not write cache {cache_file} ({e}).")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        return
+    os.replace(tmp_file, cache_file)
+
+    # Drop stale caches of the same source and profile
+    prefix = _cache_prefix(file_path, profile)
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(prefix) and name.endswith('.parquet') and path != cache_file:
+            os.remove(path)
+
+@instrumented
+def load_and_clean_data(file_path, cache_dir=None, hash_content=False, profile='full', workers=None,
+                        with_index=False):
+    """
+    Load, clean and feature-engineer the transactions CSV.
+
+    file_path may also be a directory of CSVs or a glob pattern (e.g. one
+    file per day or tenant). Partitions are then parsed and cleaned in a
+    process pool of `workers` processes (default: one per core), merged in
+    (UserID, TXN_DATE) order, and the cross-partition per-user features are
+    computed once over the merged frame.
+
+    profile='full' keeps every raw column; profile='compact' reads only
+    COMPACT_COLUMNS, stores repeated strings as categoricals and narrows
+    numeric dtypes (see memory_report for the savings). Compact amounts are
+    float32, so very large totals round to ~7 significant digits.
+
+    with_index=True returns (df, UserIndex) for O(log n) user / date slicing.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}', expected one of {PROFILES}.")
+
+    sources = resolve_sources(file_path)
+    if not sources:
+        raise FileNotFoundError(f"No CSV files found for {file_path}.")
+
+    # Serve the cleaned frame from the columnar cache when the source is unchanged
+    if cache_dir:
+        fingerprint = source_fingerprint(file_path, hash_content=hash_content)
+        cache_file = _cache_path(file_path, cache_dir, fingerprint, profile)
+        if os.path.exists(cache_file):
+            df = _read_cache(cache_file)
+            if df is not None:
+                return (df, UserIndex(df)) if with_index else df
+
+    if len(sources) == 1:
+        df = _clean_data(sources[0], profile)
+    else:
+        df = _clean_partitions(sources, profile, workers)
+
+    if cache_dir:
+        _write_cache(df, file_path, cache_dir, cache_file, profile)
+
+    return (df, UserIndex(df)) if with_index else df
+
+@instrumented
+def cleaned_parquet(file_path, cache_dir='outputs/cache', hash_content=False, profile='full'):
+    """
+    Path of the cleaned frame's Parquet cache for file_path, building it
+    first if needed, so other engines can query the cleaned data directly.
+    """
+    cache_file = _cache_path(file_path, cache_dir, source_fingerprint(file_path, hash_content), profile)
+    if not os.path.exists(cache_file):
+        load_and_clean_data(file_path, cache_dir=cache_dir, hash_content=hash_content, profile=profile)
+    if not os.path.exists(cache_file):
+        raise FileNotFoundError(f"Could not write the cleaned data cache {cache_file}.")
+    return cache_file
+
+class UserIndex:
+    """
+    Row offsets of each user in a frame sorted by (UserID, TXN_DATE), as
+    load_and_clean_data returns it.
+
+    Each user's rows are one contiguous [start, stop) range, and TXN_DATE is
+    sorted within it, so user and date-range selection are a dict lookup
+    plus a binary search, returned as a positional slice of the frame
+    instead of a boolean scan over every row.
+    """
 
-    parse_dates = ['TXN_DATE']
+    def __init__(self, df):
+        codes, uniques = pd.factorize(df['UserID'])
+        if len(codes) and ((codes < 0).any() or (np.diff(codes) < 0).any()):
+            raise ValueError("UserIndex needs a frame sorted by UserID with no missing UserIDs.")
 
-    df = pd.read_csv(file_path, dtype=dtype, parse_dates=parse_dates)
+        # Users appear in frame order, so their row counts give the offsets
+        stops = np.cumsum(np.bincount(codes, minlength=len(uniques)))
+        starts = stops - np.bincount(codes, minlength=len(uniques))
 
+        self.df = df
+        self._times = df['TXN_DATE'].to_numpy(dtype='datetime64[ns]')
+        self._bounds = dict(zip(uniques.tolist(), zip(starts.tolist(), stops.tolist())))
+
+    @property
+    def users(self):
+        return list(self._bounds)
+
+    def __contains__(self, user_id):
+        return user_id in self._bounds
+
+    def __len__(self):
+        return len(self._bounds)
+
+    def bounds(self, user_id, start=None, end=None):
+        """
+        (start, stop) row offsets of the user's rows with start <= TXN_DATE <= end
+        (either bound optional). Unknown users get an empty range.
+        """
+        lo, hi = self._bounds.get(user_id, (0, 0))
+        times = self._times[lo:hi]
+        first, last = lo, hi
+        if start is not None:
+            first = lo + int(np.searchsorted(times, pd.Timestamp(start).to_datetime64().astype(times.dtype), 'left'))
+        if end is not None:
+            last = lo + int(np.searchsorted(times, pd.Timestamp(end).to_datetime64().astype(times.dtype), 'right'))
+        return first, max(first, last)
+
+    def rows(self, user_id, start=None, end=None):
+        """
+        The user's rows (optionally within a TXN_DATE range) as a slice of
+        the indexed frame.
+        """
+        first, last = self.bounds(user_id, start, end)
+        return self.df.iloc[first:last]
+
+    def positions(self):
+        """
+        Row positions of every user, in sorted UserID order - the layout the
+        per-user detectors iterate over.
+        """
+        ranges = sorted(self._bounds.items(), key=lambda item: item[0])
+        return [np.arange(lo, hi) for _, (lo, hi) in ranges]
+
+DTYPES = {
+    'UserID': str,
+    'TXN_ID': str,
+    'MERC_TXN_ID': str,
+    'TXN_TYPE': str,
+    'CURRENCY': str,
+    'APPLICATION_ID': str
+}
+
+ROLLING_WINDOWS = {'Rolling_7D_Spend': '7D', 'Rolling_30D_Spend': '30D'}
+
+PROFILES = ('full', 'compact')
+
+# Raw columns the services and dashboard actually read
+COMPACT_COLUMNS = [
+    'ID', 'TXN_ID', 'MERC_TXN_ID', 'TXN_DATE', 'TXN_AMOUNT', 'FEE_AMOUNT',
+    'TXN_TYPE', 'CURRENCY_CODE', 'TENANT_ID', 'UserID'
+]
+
+COMPACT_DTYPES = {
+    'UserID': 'category',
+    'TXN_ID': str,
+    'MERC_TXN_ID': 'category',
+    'TXN_TYPE': 'category',
+    'CURRENCY_CODE': 'category'
+}
+
+COMPACT_NUMERIC_DTYPES = {
+    'TXN_AMOUNT': 'float32',
+    'FEE_AMOUNT': 'float32',
+    'Weekday': 'int8',
+    'Weekend': 'int8',
+    'Hour': 'int8',
+    'Days_Since_Last_TXN': 'float32',
+    'Rolling_7D_Spend': 'float32',
+    'Rolling_30D_Spend': 'float32',
+    'Merchant_Spend_Ratio': 'float32',
+    'Fee_to_Txn_Ratio': 'float32'
+}
+
+@instrumented
+def _read_raw(file_path, chunksize=None, usecols=None, profile='full'):
+    if profile == 'compact':
+        return pd.read_csv(file_path, dtype=COMPACT_DTYPES, parse_dates=['TXN_DATE'], chunksize=chunksize,
+                           usecols=usecols or COMPACT_COLUMNS)
+    return pd.read_csv(file_path, dtype=DTYPES, parse_dates=['TXN_DATE'], chunksize=chunksize, usecols=usecols)
+
+def _compact_dtypes(df):
+    # Narrow numeric columns one at a time; features were derived at full precision
+    for column, dtype in COMPACT_NUMERIC_DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    for column in df.select_dtypes('category').columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+def memory_report(full_df, compact_df):
+    """
+    Bytes used per column by a full vs compact frame, largest saving first.
+    Columns dropped by the compact profile count as fully saved.
+    """
+    full_bytes = full_df.memory_usage(deep=True, index=False)
+    compact_bytes = compact_df.memory_usage(deep=True, index=False).reindex(full_bytes.index, fill_value=0)
+    report = pd.DataFrame({'Full_Bytes': full_bytes, 'Compact_Bytes': compact_bytes})
+    report['Saved_Bytes'] = report['Full_Bytes'] - report['Compact_Bytes']
+    return (
+        report.rename_axis('Column')
+        .reset_index()
+        .sort_values('Saved_Bytes', ascending=False)
+        .reset_index(drop=True)
+    )
+
+@instrumented
+def _clean_rows(df):
     # Basic cleaning
     df['TXN_AMOUNT'] = pd.to_numeric(df['TXN_AMOUNT'], errors='coerce')
     df['FEE_AMOUNT'] = pd.to_numeric(df['FEE_AMOUNT'], errors='coerce')
 
-    df['FEE_AMOUNT'].fillna(0, inplace=True)
+    df['FEE_AMOUNT'] = df['FEE_AMOUNT'].fillna(0)
 
     # Ensure datetime parsing
     df['TXN_DATE'] = pd.to_datetime(df['TXN_DATE'], errors='coerce')
@@ -30,7 +300,7 @@ def load_and_clean_data(file_path):
     # Add extra engineered features
     df['YearMonth'] = df['TXN_DATE'].dt.to_period('M')
     df['Weekday'] = df['TXN_DATE'].dt.weekday
-    df['Weekend'] = df['Weekday'].apply(lambda x: 1 if x >= 5 else 0)
+    df['Weekend'] = (df['Weekday'] >= 5).astype('int64')
     df['Hour'] = df['TXN_DATE'].dt.hour
 
     # Transaction Amount Binning
@@ -38,52 +308,79 @@ def load_and_clean_data(file_path):
     labels = ['<10', '10-100', '100-500', '500+']
     df['TXN_Amount_Bin'] = pd.cut(df['TXN_AMOUNT'], bins=bins, labels=labels)
 
-    # Days Since Last Transaction per User
-    df = df.sort_values(['UserID', 'TXN_DATE'])
-    df['Days_Since_Last_TXN'] = df.groupby('UserID')['TXN_DATE'].diff().dt.days
+    return df
 
-    # Aggregate multiple transactions on same day
-    daily_spend_df = df.groupby(['UserID', 'TXN_DATE'])['TXN_AMOUNT'].sum().reset_index()
+@instrumented
+def _add_rolling_spend(df):
+    # Rolling 7D / 30D spend per user, all windows in one vectorized pass
+    rolling = rolling_window_features(df, windows=ROLLING_WINDOWS.values(), aggs=('sum',))
+    for column in ROLLING_WINDOWS:
+        df[column] = rolling[column].to_numpy()
+    return df
 
-    # Calculate rolling 7D spend
-    rolling_7d = (
-        daily_spend_df.sort_values(['UserID', 'TXN_DATE'])
-        .groupby('UserID')
-        .apply(lambda group: group.set_index('TXN_DATE')['TXN_AMOUNT'].rolling('7D').sum())
-        .reset_index()
-        .rename(columns={'TXN_AMOUNT': 'Rolling_7D_Spend'})
-    )
+def _validate(df):
+    # Validation Assertions
+    assert df['TXN_AMOUNT'].isnull().sum() == 0, "Transaction Amount cannot have NULLs!"
+    assert pd.api.types.is_numeric_dtype(df['TXN_AMOUNT']), "Transaction Amount must be numeric!"
+    assert df['TXN_DATE'].isnull().sum() == 0, "Transaction Date cannot have NULLs!"
+    assert df['UserID'].isnull().sum() == 0, "UserID must not have NULLs!"
 
-    # Calculate rolling 30D spend
-    rolling_30d = (
-        daily_spend_df.sort_values(['UserID', 'TXN_DATE'])
-        .groupby('UserID')
-        .apply(lambda group: group.set_index('TXN_DATE')['TXN_AMOUNT'].rolling('30D').sum())
-        .reset_index()
-        .rename(columns={'TXN_AMOUNT': 'Rolling_30D_Spend'})
-    )
+def _count_duplicates(df):
+    return df.duplicated(subset=['UserID', 'TXN_DATE', 'TXN_AMOUNT']).sum()
+
+def _warn_duplicates(duplicate_count):
+    if duplicate_count > 0:
+        print(f"Warning: {duplicate_count} duplicate transactions found based on UserID + TXN_DATE + TXN_AMOUNT!")
+
+def _clean_data(file_path, profile='full'):
+    return _add_user_features(_clean_rows(_read_raw(file_path, profile=profile)), profile)
 
-    # Merge rolling spends back into main df
-    df = pd.merge(df, rolling_7d, on=['UserID', 'TXN_DATE'], how='left')
-    df = pd.merge(df, rolling_30d, on=['UserID', 'TXN_DATE'], how='left')
+@instrumented
+def _clean_partition(file_path, profile):
+    # Row-local cleaning only; per-user features need every partition
+    df = _clean_rows(_read_raw(file_path, profile=profile))
+    return df.sort_values(['UserID', 'TXN_DATE'], kind='mergesort')
+
+@instrumented
+def _clean_partitions(sources, profile, workers=None):
+    if workers == 1:
+        parts = [_clean_partition(path, profile) for path in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_clean_partition, sources, [profile] * len(sources)))
+
+    df = pd.concat(parts, ignore_index=True)
+    if profile == 'compact':
+        # Each partition has its own category set; re-unify after the concat
+        for column, dtype in COMPACT_DTYPES.items():
+            if dtype == 'category':
+                df[column] = df[column].astype('category')
+
+    return _add_user_features(df, profile)
+
+@instrumented
+def _add_user_features(df, profile='full'):
+    # Days Since Last Transaction per User
+    df = df.sort_values(['UserID', 'TXN_DATE']).reset_index(drop=True)
+    df['Days_Since_Last_TXN'] = df.groupby('UserID', observed=True)['TXN_DATE'].diff().dt.days
+
+    # Rolling 7D / 30D spend
+    df = _add_rolling_spend(df)
 
     # Merchant Spend Ratio
-    total_user_spend = df.groupby('UserID')['TXN_AMOUNT'].transform('sum')
+    total_user_spend = df.groupby('UserID', observed=True)['TXN_AMOUNT'].transform('sum')
     df['Merchant_Spend_Ratio'] = df['TXN_AMOUNT'] / total_user_spend
 
     # Fee to Transaction Ratio
     df['Fee_to_Txn_Ratio'] = df['FEE_AMOUNT'] / df['TXN_AMOUNT']
 
-    # Validation Assertions
-    assert df['TXN_AMOUNT'].isnull().sum() == 0, "Transaction Amount cannot have NULLs!"
-    assert pd.api.types.is_numeric_dtype(df['TXN_AMOUNT']), "Transaction Amount must be numeric!"
-    assert df['TXN_DATE'].isnull().sum() == 0, "Transaction Date cannot have NULLs!"
-    assert df['UserID'].isnull().sum() == 0, "UserID must not have NULLs!"
+    if profile == 'compact':
+        df = _compact_dtypes(df)
+
+    _validate(df)
 
     # Warning for duplicates
-    duplicate_count = df.duplicated(subset=['UserID', 'TXN_DATE', 'TXN_AMOUNT']).sum()
-    if duplicate_count > 0:
-        print(f"Warning: {duplicate_count} duplicate transactions found based on UserID + TXN_DATE + TXN_AMOUNT!")
+    _warn_duplicates(_count_duplicates(df))
 
     # Create data dictionary JSON
     print("Finished cleaning and attempting to save data dictionary...")
@@ -91,7 +388,129 @@ def load_and_clean_data(file_path):
     data_dictionary = {
         column: str(dtype) for column, dtype in zip(df.columns, df.dtypes)
     }
-    with open('outputs/data_dictionary.json', 'w') as f:
+    dictionary_file = 'outputs/data_dictionary.json' if profile == 'full' else f'outputs/data_dictionary_{profile}.json'
+    with open(dictionary_file, 'w') as f:
         json.dump(data_dictionary, f, indent=4)
 
     return df
+
+@instrumented
+def _user_totals(file_path, chunksize):
+    # First, narrow pass: total spend per user for Merchant_Spend_Ratio, also
+    # checking the TXN_DATE order so unsorted files fail before any output
+    totals = None
+    last_date = None
+    for chunk in _read_raw(file_path, chunksize=chunksize, usecols=['UserID', 'TXN_DATE', 'TXN_AMOUNT']):
+        chunk['TXN_AMOUNT'] = pd.to_numeric(chunk['TXN_AMOUNT'], errors='coerce')
+        chunk['TXN_DATE'] = pd.to_datetime(chunk['TXN_DATE'], errors='coerce')
+        chunk = chunk.dropna(subset=['UserID', 'TXN_DATE', 'TXN_AMOUNT'])
+        if chunk.empty:
+            continue
+        if not chunk['TXN_DATE'].is_monotonic_increasing or (last_date is not None
+                                                             and chunk['TXN_DATE'].iloc[0] < last_date):
+            raise ValueError(f"Streaming mode requires {file_path} to be sorted by TXN_DATE; sort it first "
+                             "or use load_and_clean_data.")
+        last_date = chunk['TXN_DATE'].iloc[-1]
+        chunk_totals = chunk.groupby('UserID')['TXN_AMOUNT'].sum()
+        totals = chunk_totals if totals is None else totals.add(chunk_totals, fill_value=0)
+    return totals if totals is not None else pd.Series(dtype=float)
+
+TAIL_COLUMNS = ['UserID', 'TXN_DATE', 'TXN_AMOUNT']
+
+def _empty_tail():
+    return pd.DataFrame({
+        'UserID': pd.Series(dtype=object),
+        'TXN_DATE': pd.Series(dtype='datetime64[ns]'),
+        'TXN_AMOUNT': pd.Series(dtype=float)
+    })
+
+def _trim_tail(tail):
+    # Keep each user's rows that later windows can still reach (always incl. the last one)
+    max_window = max(pd.Timedelta(window) for window in ROLLING_WINDOWS.values())
+    last_seen = tail.groupby('UserID', observed=True)['TXN_DATE'].transform('max')
+    return tail[tail['TXN_DATE'] > last_seen - max_window].reset_index(drop=True)
+
+def _add_features_with_tail(ready, tail, totals):
+    """
+    Per-user features for rows that follow already-processed history.
+
+    `tail` holds TAIL_COLUMNS for each user's rows inside the longest rolling
+    window; `totals` maps UserID to total spend. Returns the featured rows,
+    sorted by UserID/TXN_DATE, and the updated tail.
+    """
+    # Prepend each user's carried tail so diffs and windows see prior history
+    ready = ready.sort_values(['UserID', 'TXN_DATE'], kind='mergesort')
+    keys = ready[TAIL_COLUMNS].assign(_row=range(len(ready)))
+    user_tail = tail[tail['UserID'].isin(keys['UserID'].unique())].assign(_row=-1)
+    keys = pd.concat([user_tail, keys], ignore_index=True).sort_values(['UserID', 'TXN_DATE'], kind='mergesort')
+
+    keys['Days_Since_Last_TXN'] = keys.groupby('UserID', observed=True)['TXN_DATE'].diff().dt.days
+    keys = _add_rolling_spend(keys)
+    keys = keys[keys['_row'] >= 0].sort_values('_row')
+
+    out = ready.copy()
+    for column in ['Days_Since_Last_TXN', *ROLLING_WINDOWS]:
+        out[column] = keys[column].to_numpy()
+    out['Merchant_Spend_Ratio'] = out['TXN_AMOUNT'] / out['UserID'].map(totals).astype(float)
+    out['Fee_to_Txn_Ratio'] = out['FEE_AMOUNT'] / out['TXN_AMOUNT']
+
+    tail = _trim_tail(pd.concat([tail, ready[TAIL_COLUMNS]], ignore_index=True))
+    return out, tail
+
+def iter_clean_chunks(file_path, chunksize=100_000):
+    """
+    Streaming variant of load_and_clean_data for files larger than memory.
+
+    Yields cleaned, feature-engineered chunks with the same columns as the
+    full load. The file must be sorted by TXN_DATE (ties allowed), which
+    data/transactions.csv is not; the first pass checks this and raises
+    ValueError before any chunk is yielded. Per-user state (each user's
+    transactions inside the longest rolling window) is carried between
+    chunks so Days_Since_Last_TXN and the rolling spends match a full load.
+    Merchant_Spend_Ratio needs each user's total, which that first pass
+    collects over three columns only.
+
+    Peak memory is bounded by chunksize plus the rolling-window tail per user.
+    """
+    totals = _user_totals(file_path, chunksize)
+    tail = _empty_tail()
+    pending = None
+    emitted_until = None
+    duplicate_count = 0
+    offset = 0
+
+    chunks = _read_raw(file_path, chunksize=chunksize)
+    while True:
+        chunk = next(chunks, None)
+        if chunk is not None:
+            chunk = _clean_rows(chunk)
+            if pending is not None:
+                chunk = pd.concat([pending, chunk])
+            if chunk.empty:
+                continue
+            if emitted_until is not None and chunk['TXN_DATE'].min() <= emitted_until:
+                raise ValueError("Streaming mode requires the file to be sorted by TXN_DATE.")
+
+            # Rows on the last timestamp may continue in the next chunk; hold them back
+            last_ts = chunk['TXN_DATE'].max()
+            ready = chunk[chunk['TXN_DATE'] < last_ts]
+            pending = chunk[chunk['TXN_DATE'] == last_ts]
+        else:
+            if pending is None or pending.empty:
+                break
+            ready, pending = pending, None
+
+        if ready.empty:
+            continue
+
+        out, tail = _add_features_with_tail(ready, tail, totals)
+        out.index = pd.RangeIndex(offset, offset + len(out))
+        offset += len(out)
+
+        _validate(out)
+        duplicate_count += _count_duplicates(out)
+
+        emitted_until = ready['TXN_DATE'].max()
+        yield out
+
+    _warn_duplicates(duplicate_count)
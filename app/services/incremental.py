@@ -0,0 +1,190 @@
+import pandas as pd
+import os
+import json
+import glob
+from app.services.data_loader import (
+    COMPACT_DTYPES,
+    PROFILES,
+    TAIL_COLUMNS,
+    _add_features_with_tail,
+    _add_user_features,
+    _clean_rows,
+    _compact_dtypes,
+    _count_duplicates,
+    _read_raw,
+    _trim_tail,
+    _validate,
+    _warn_duplicates
+)
+from app.services.aggregation import build_merchant_table, update_merchant_table
+from app.services.instrumentation import instrumented
+
+WATERMARK_COLUMNS = ('TXN_DATE', 'ID')
+
+def _paths(store_dir):
+    return {
+        'watermark': os.path.join(store_dir, 'watermark.json'),
+        'totals': os.path.join(store_dir, 'user_totals.parquet'),
+        'tail': os.path.join(store_dir, 'user_tail.parquet'),
+        'merchants': os.path.join(store_dir, 'merchant_table.parquet')
+    }
+
+def _part_files(store_dir):
+    return sorted(glob.glob(os.path.join(store_dir, 'part-*.parquet')))
+
+def _write_parquet(df, path):
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def read_watermark(store_dir='outputs/store'):
+    """
+    Returns the store's watermark dict ({'column', 'value', 'profile'}), or
+    None if nothing has been ingested yet.
+    """
+    path = _paths(store_dir)['watermark']
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _save_state(store_dir, part, totals, tail, merchants, watermark):
+    paths = _paths(store_dir)
+    os.makedirs(store_dir, exist_ok=True)
+
+    part_file = os.path.join(store_dir, f"part-{len(_part_files(store_dir)):05d}.parquet")
+    _write_parquet(part, part_file)
+    _write_parquet(totals.rename('Total_Spend').rename_axis('UserID').reset_index(), paths['totals'])
+    _write_parquet(tail, paths['tail'])
+    _write_parquet(merchants.astype({'UserID': object, 'MERC_TXN_ID': object}), paths['merchants'])
+
+    # Watermark goes last: a crash before this point re-ingests the same delta
+    with open(paths['watermark'] + '.tmp', 'w') as f:
+        json.dump(watermark, f, indent=4)
+    os.replace(paths['watermark'] + '.tmp', paths['watermark'])
+
+def _check_ids(df, file_path):
+    # Rows at or below the ID watermark are skipped as already ingested, which
+    # is only safe if IDs never repeat or go backwards
+    ids = df['ID']
+    if ids.isna().any() or not ids.is_unique or not ids.is_monotonic_increasing:
+        raise ValueError(f"The ID watermark needs unique, strictly increasing IDs in {file_path}; "
+                         "use watermark_col='TXN_DATE' instead.")
+
+def _watermark_value(df, column):
+    value = df[column].max()
+    return value.isoformat() if column == 'TXN_DATE' else int(value)
+
+@instrumented
+def ingest_increment(file_path, store_dir='outputs/store', watermark_col='TXN_DATE', profile='full'):
+    """
+    Append transactions newer than the store's watermark and update features.
+
+    The first call cleans `file_path` in full and seeds the store. Later
+    calls keep only rows with watermark_col above the stored watermark, and
+    compute Days_Since_Last_TXN and the rolling spends for those rows from
+    each affected user's persisted rolling-window tail. Per-user totals are
+    updated so Merchant_Spend_Ratio is refreshed in load_store, and the
+    per-user merchant table (load_merchant_table) is updated. Cost scales
+    with the delta (plus the affected users' tails), not the history.
+
+    watermark_col='ID' requires every file's IDs to be unique and strictly
+    increasing in file order (data/transactions.csv's are not) and raises
+    ValueError otherwise, rather than silently dropping rows with a reused
+    or lower ID. Rows arriving later than newer history (possible with the
+    ID watermark) get features relative to what is already stored.
+
+    Returns the number of rows appended.
+    """
+    if watermark_col not in WATERMARK_COLUMNS:
+        raise ValueError(f"watermark_col must be one of {WATERMARK_COLUMNS}.")
+
+    watermark = read_watermark(store_dir)
+
+    if watermark is None:
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile '{profile}', expected one of {PROFILES}.")
+        rows = _clean_rows(_read_raw(file_path, profile=profile))
+        if watermark_col == 'ID':
+            _check_ids(rows, file_path)
+        df = _add_user_features(rows, profile)
+        totals = df.groupby('UserID', observed=True)['TXN_AMOUNT'].sum().astype(float)
+        tail = _trim_tail(df[TAIL_COLUMNS].astype({'UserID': object, 'TXN_AMOUNT': float}))
+        _save_state(store_dir, df, totals, tail, build_merchant_table(df), {
+            'column': watermark_col,
+            'value': _watermark_value(df, watermark_col),
+            'profile': profile
+        })
+        return len(df)
+
+    if watermark['column'] != watermark_col:
+        raise ValueError(f"Store at {store_dir} is watermarked on {watermark['column']}, not {watermark_col}.")
+    profile = watermark['profile']
+
+    new = _clean_rows(_read_raw(file_path, profile=profile))
+    if watermark_col == 'TXN_DATE':
+        new = new[new['TXN_DATE'] > pd.Timestamp(watermark['value'])]
+    else:
+        _check_ids(new, file_path)
+        new = new[new['ID'] > watermark['value']]
+
+    if new.empty:
+        return 0
+
+    paths = _paths(store_dir)
+    totals = pd.read_parquet(paths['totals']).set_index('UserID')['Total_Spend']
+    tail = pd.read_parquet(paths['tail'])
+    merchants = update_merchant_table(pd.read_parquet(paths['merchants']), new)
+
+    delta_totals = new.groupby('UserID', observed=True)['TXN_AMOUNT'].sum().astype(float)
+    delta_totals.index = delta_totals.index.astype(object)
+    totals = totals.add(delta_totals, fill_value=0)
+
+    part, tail = _add_features_with_tail(new, tail, totals)
+    tail = tail.astype({'UserID': object, 'TXN_AMOUNT': float})
+    if profile == 'compact':
+        part = _compact_dtypes(part)
+
+    _validate(part)
+    _warn_duplicates(_count_duplicates(part))
+
+    _save_state(store_dir, part, totals, tail, merchants, {
+        'column': watermark_col,
+        'value': _watermark_value(new, watermark_col),
+        'profile': profile
+    })
+    return len(part)
+
+@instrumented
+def load_store(store_dir='outputs/store'):
+    """
+    Read the incrementally built dataset back as one frame, ordered like
+    load_and_clean_data, with Merchant_Spend_Ratio against current totals.
+    """
+    watermark = read_watermark(store_dir)
+    if watermark is None:
+        raise FileNotFoundError(f"No ingested data found in {store_dir}.")
+
+    df = pd.concat([pd.read_parquet(path) for path in _part_files(store_dir)], ignore_index=True)
+    if watermark['profile'] == 'compact':
+        # Parts carry their own category sets; re-unify them
+        for column, dtype in COMPACT_DTYPES.items():
+            if dtype == 'category':
+                df[column] = df[column].astype('category')
+
+    df = df.sort_values(['UserID', 'TXN_DATE'], kind='mergesort').reset_index(drop=True)
+
+    totals = pd.read_parquet(_paths(store_dir)['totals']).set_index('UserID')['Total_Spend']
+    df['Merchant_Spend_Ratio'] = (df['TXN_AMOUNT'] / df['UserID'].map(totals).astype(float)).astype(
+        df['Merchant_Spend_Ratio'].dtype)
+    return df
+
+def load_merchant_table(store_dir='outputs/store'):
+    """
+    The store's per-(UserID, MERC_TXN_ID) counts and spend, kept current by
+    ingest_increment; pass it to top_merchants(merchant_table=...).
+    """
+    path = _paths(store_dir)['merchants']
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No merchant table found in {store_dir}.")
+    return pd.read_parquet(path)
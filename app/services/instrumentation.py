@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import itertools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+# TXN_INSTRUMENT turns instrumentation on: "1" records wall time and rows in /
+# out per call; add "memory" (tracemalloc peak, slows sklearn a lot) and / or
+# "profile" (cProfile dump of each top-level call), e.g. TXN_INSTRUMENT=memory,profile
+_OPTIONS = {option.strip().lower() for option in os.environ.get('TXN_INSTRUMENT', '').split(',')} - {'', '0'}
+
+ENABLED = bool(_OPTIONS)
+TRACK_MEMORY = 'memory' in _OPTIONS
+PROFILE = 'profile' in _OPTIONS
+
+# JSON lines, one per call; "-" logs to stderr
+LOG_PATH = os.environ.get('TXN_INSTRUMENT_LOG', 'outputs/instrumentation.jsonl')
+PROFILE_DIR = os.environ.get('TXN_PROFILE_DIR', 'outputs/profiles')
+
+_local = threading.local()
+_log_lock = threading.Lock()
+# One cProfile at a time; calls that find it taken are timed but not profiled
+_profile_lock = threading.Lock()
+_calls = itertools.count()
+
+def _reset_after_fork():
+    # Forked pool workers start with no open calls and collect nothing
+    global _local
+    _local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, tuple):
+        counts = [_rows(part) for part in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+    return None
+
+def _stack():
+    # Per-thread stack of open calls, each with the highest child peak seen
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def _emit(record):
+    records = getattr(_local, 'records', None)
+    if records is not None:
+        records.append(record)
+    if not LOG_PATH:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        if LOG_PATH == '-':
+            print(line, file=sys.stderr)
+            return
+        os.makedirs(os.path.dirname(LOG_PATH) or '.', exist_ok=True)
+        with open(LOG_PATH, 'a') as f:
+            f.write(line + '\n')
+
+@contextmanager
+def timed(stage, rows_in=None):
+    """
+    Record the enclosed block as one call of `stage`. A no-op unless
+    instrumentation is enabled.
+    """
+    if not ENABLED:
+        yield {}
+        return
+
+    stack = _stack()
+    frame = {'child_peak': 0}
+    stack.append(frame)
+    record = {'stage': stage, 'call': next(_calls), 'depth': len(stack) - 1, 'rows_in': rows_in,
+              'rows_out': None}
+
+    if TRACK_MEMORY:
+        # Tracing stays on once started; peaks are process-wide, so calls
+        # running concurrently in other threads count towards each other's
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Reset the peak for this call; the outer call's peak so far is kept
+        # on its frame and combined again on the way out
+        outer_peak = tracemalloc.get_traced_memory()[1]
+        if len(stack) > 1:
+            stack[-2]['child_peak'] = max(stack[-2]['child_peak'], outer_peak)
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+
+    profiler = None
+    if PROFILE and len(stack) == 1 and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['seconds'] = round(time.perf_counter() - started, 6)
+
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{stage}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            profiler.dump_stats(path)
+            record['profile'] = path
+
+        stack.pop()
+        if TRACK_MEMORY:
+            peak = max(tracemalloc.get_traced_memory()[1], frame['child_peak'])
+            record['peak_mb'] = round(max(peak - start_memory, 0) / 2 ** 20, 3)
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak)
+
+        record['ts'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        record['thread'] = threading.current_thread().name
+        record['pid'] = os.getpid()
+        _emit(record)
+
+def instrumented(func):
+    """
+    Decorator recording each call of func with timed(), named
+    '<module>.<function>'. Rows in are the length of the first DataFrame
+    argument, rows out that of the returned frame / Series (summed over a
+    tuple of them). When instrumentation is
+    off func is returned unchanged, so there is no overhead.
+    """
+    if not ENABLED:
+        return func
+
+    stage = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rows_in = next((len(arg) for arg in args if isinstance(arg, pd.DataFrame)), None)
+        with timed(stage, rows_in) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+        return result
+
+    return wrapper
+
+def start_collecting():
+    # Keep this thread's records (e.g. one Streamlit rerun) for stage_report()
+    _local.records = []
+
+def stop_collecting():
+    records = getattr(_local, 'records', None) or []
+    _local.records = None
+    return records
+
+def stage_report(records):
+    """
+    Per-stage breakdown of collected records in call order: calls, total
+    seconds, share of the top-level time, rows in / out and peak MB (with
+    TXN_INSTRUMENT=memory). Nested stages are indented under their caller.
+    """
+    columns = ['Stage', 'Calls', 'Seconds', 'Share', 'Rows_In', 'Rows_Out', 'Peak_MB']
+    if not records:
+        return pd.DataFrame(columns=columns)
+
+    # Records are emitted as calls finish; order them by when they started
+    df = pd.DataFrame(records).sort_values('call')
+    if 'peak_mb' not in df.columns:
+        df['peak_mb'] = None
+        columns.remove('Peak_MB')
+    df['Stage'] = df['depth'].map(lambda depth: '· ' * depth) + df['stage']
+    report = (
+        df.groupby(['Stage', 'depth'], sort=False)
+        .agg(Calls=('seconds', 'size'), Seconds=('seconds', 'sum'), Rows_In=('rows_in', 'max'),
+             Rows_Out=('rows_out', 'max'), Peak_MB=('peak_mb', 'max'))
+        .reset_index()
+    )
+    total = df.loc[df['depth'] == 0, 'seconds'].sum()
+    report['Share'] = report['Seconds'] / total if total else 0.0
+    return report[columns]
@@ -0,0 +1,180 @@
+import os
+import re
+import hashlib
+from collections import OrderedDict
+
+import joblib
+import pandas as pd
+import sklearn
+from sklearn.ensemble import IsolationForest
+from app.services.instrumentation import instrumented
+
+class OutlierModelRegistry:
+    """
+    Fit-once store of per-user IsolationForest models.
+
+    Models are keyed by (UserID, data version), kept in a bounded in-memory
+    LRU and persisted under model_dir, so a rerun or restart reuses the fit
+    instead of refitting on the user's whole history. The data version is a
+    hash of the user's TXN_AMOUNT values unless one is passed explicitly.
+
+    File names hash the UserID (so IDs differing only in case or special
+    characters never share a file) and the data version together with
+    contamination, random_state and the sklearn version, so a registry with
+    other parameters never loads a stale fit. Each user keeps up to
+    max_versions_per_user files on disk (e.g. one per date range viewed);
+    the least recently used are removed beyond that.
+    """
+
+    def __init__(self, model_dir='outputs/models', max_models=128, contamination=0.01,
+                 random_state=42, min_history=10, max_versions_per_user=8):
+        self.model_dir = model_dir
+        self.max_models = max_models
+        self.max_versions_per_user = max_versions_per_user
+        self.contamination = contamination
+        self.random_state = random_state
+        self.min_history = min_history
+        self._models = OrderedDict()
+        self._latest = {}
+
+    @staticmethod
+    def data_version(user_df):
+        hashed = pd.util.hash_pandas_object(user_df['TXN_AMOUNT'], index=False).to_numpy()
+        return hashlib.sha1(hashed.tobytes()).hexdigest()[:16]
+
+    @staticmethod
+    def _user_prefix(user_id):
+        # Lower-case hex, so distinct IDs stay distinct on any filesystem
+        return hashlib.sha1(f"{type(user_id).__name__}:{user_id}".encode()).hexdigest()[:20]
+
+    def _model_file(self, user_id, version):
+        params = f"{version}|{self.contamination}|{self.random_state}|{sklearn.__version__}"
+        model_hash = hashlib.sha1(params.encode()).hexdigest()[:16]
+        return os.path.join(self.model_dir, f"{self._user_prefix(user_id)}-{model_hash}.joblib")
+
+    @staticmethod
+    def _touch(model_file):
+        # Mark as recently used for _evict_versions (another registry may
+        # already have removed it)
+        try:
+            os.utime(model_file)
+        except FileNotFoundError:
+            pass
+
+    def _load(self, model_file):
+        model = joblib.load(model_file)
+        self._touch(model_file)
+        return model
+
+    def _evict_versions(self, user_id):
+        # Keep the user's max_versions_per_user most recently used model files
+        pattern = re.compile(rf"{self._user_prefix(user_id)}-[0-9a-f]{{16}}\.joblib")
+        paths = [os.path.join(self.model_dir, name) for name in os.listdir(self.model_dir)
+                 if pattern.fullmatch(name)]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[self.max_versions_per_user:]:
+            os.remove(path)
+
+    def _remember(self, key, model):
+        self._models[key] = model
+        self._models.move_to_end(key)
+        while len(self._models) > self.max_models:
+            self._models.popitem(last=False)
+
+    @instrumented
+    def _fit(self, user_id, user_df, version):
+        amounts = user_df['TXN_AMOUNT'].to_numpy().reshape(-1, 1)
+        model = IsolationForest(contamination=self.contamination, random_state=self.random_state)
+        model.fit(amounts)
+
+        os.makedirs(self.model_dir, exist_ok=True)
+        model_file = self._model_file(user_id, version)
+        joblib.dump(model, model_file + '.tmp')
+        os.replace(model_file + '.tmp', model_file)
+        self._evict_versions(user_id)
+        return model
+
+    @instrumented
+    def get_model(self, user_id, user_df, data_version=None):
+        """
+        Returns the user's model for this data, fitting it only on a miss in
+        both memory and disk. Returns None below min_history transactions.
+        """
+        if len(user_df) < self.min_history:
+            return None
+
+        version = data_version or self.data_version(user_df)
+        key = (user_id, version)
+        self._latest[user_id] = version
+
+        if key in self._models:
+            self._models.move_to_end(key)
+            self._touch(self._model_file(user_id, version))
+            return self._models[key]
+
+        model_file = self._model_file(user_id, version)
+        if os.path.exists(model_file):
+            model = self._load(model_file)
+        else:
+            model = self._fit(user_id, user_df, version)
+
+        self._remember(key, model)
+        return model
+
+    @instrumented
+    def outlier_mask(self, user_id, user_df, data_version=None):
+        """
+        Row-aligned boolean outlier flags for a single user's frame, served
+        from the registered model (all False below min_history).
+        """
+        model = self.get_model(user_id, user_df, data_version)
+        if model is None:
+            return pd.Series(False, index=user_df.index, name='Outlier')
+
+        preds = model.predict(user_df['TXN_AMOUNT'].to_numpy().reshape(-1, 1))
+        return pd.Series(preds == -1, index=user_df.index, name='Outlier')
+
+    def flag_outliers(self, user_id, user_df, data_version=None):
+        """
+        Same result as detect_outliers() on a single user's frame, served
+        from the registered model.
+        """
+        if len(user_df) < self.min_history:
+            return pd.DataFrame()
+
+        outlier_txns = user_df[self.outlier_mask(user_id, user_df, data_version).to_numpy()].copy()
+        outlier_txns['Anomaly_Type'] = 'Outlier'
+        return outlier_txns
+
+    @instrumented
+    def score_transaction(self, user_id, txn, user_df=None, data_version=None):
+        """
+        Predict-only check of one new transaction against the user's model.
+
+        txn is a mapping (or one-row frame) with TXN_AMOUNT. Pass user_df
+        the first time a user is seen; afterwards the latest registered model
+        is used. Returns True if the transaction is an outlier, None if the
+        user has too little history to score.
+        """
+        if user_df is not None:
+            model = self.get_model(user_id, user_df, data_version)
+        elif user_id in self._latest:
+            key = (user_id, self._latest[user_id])
+            model = self._models.get(key)
+            if model is None:
+                try:
+                    model = self._load(self._model_file(*key))
+                except FileNotFoundError:
+                    # Evicted from disk since it was registered
+                    raise KeyError(f"No model registered for user {user_id}; pass user_df to fit one.") from None
+                self._remember(key, model)
+        else:
+            raise KeyError(f"No model registered for user {user_id}; pass user_df to fit one.")
+
+        if model is None:
+            return None
+
+        amount = txn['TXN_AMOUNT']
+        if isinstance(amount, pd.Series):
+            amount = amount.iloc[0]
+        return bool(model.predict([[float(amount)]])[0] == -1)
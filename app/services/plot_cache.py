@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.services.visualization import CHARTS, figure_png
+
+# Bump when a *_figure function changes, so old PNGs are not reused
+PLOT_VERSION = 2
+
+MANIFEST_FILE = '.plot_manifest.json'
+
+def chart_key(chart, data, user_id):
+    """
+    Content hash of everything a chart depends on: the chart name, the
+    user and the values / dtypes of the columns the chart reads.
+    """
+    columns = [col for col in CHARTS[chart][1] if col in data.columns]
+    data = data[columns]
+    digest = hashlib.sha256(f"{PLOT_VERSION}|{chart}|{user_id}|{len(data)}".encode())
+    for col in columns:
+        digest.update(f"|{col}:{data[col].dtype}".encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class PlotCache:
+    """
+    Rendered chart PNGs keyed on chart_key(), so an unchanged chart is drawn
+    once and reused on every rerun.
+
+    Rendering runs on a small thread pool; png() waits for the result,
+    submit() / export() return futures so the caller is not blocked.
+    export() also skips rewriting a file whose recorded key (kept in a
+    manifest next to the PNGs) has not changed.
+    """
+
+    def __init__(self, max_entries=64, workers=2):
+        self.max_entries = max_entries
+        self.renders = 0
+        self.hits = 0
+        self.writes = 0
+        self._pngs = OrderedDict()
+        self._pending = {}
+        self._manifests = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plot-render')
+
+    def _render(self, key, chart, data, user_id):
+        try:
+            fig = CHARTS[chart][0](data, user_id)
+            png = None if fig is None else figure_png(fig)
+            with self._lock:
+                self.renders += 1
+                self._pngs[key] = png
+                while len(self._pngs) > self.max_entries:
+                    self._pngs.popitem(last=False)
+            return png
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def submit(self, chart, data, user_id):
+        """
+        Future of the chart's PNG bytes (None if there is nothing to draw).
+        A chart already cached or being rendered is not rendered again.
+        """
+        key = chart_key(chart, data, user_id)
+        with self._lock:
+            if key in self._pngs:
+                self._pngs.move_to_end(key)
+                self.hits += 1
+                future = _done(self._pngs[key])
+            elif key in self._pending:
+                future = self._pending[key]
+            else:
+                future = self._pending[key] = self._pool.submit(self._render, key, chart, data, user_id)
+        return future
+
+    def png(self, chart, data, user_id):
+        return self.submit(chart, data, user_id).result()
+
+    def _manifest(self, save_path):
+        manifest = self._manifests.get(save_path)
+        if manifest is None:
+            manifest_file = os.path.join(save_path, MANIFEST_FILE)
+            manifest = {}
+            if os.path.exists(manifest_file):
+                with open(manifest_file) as f:
+                    manifest = json.load(f)
+            self._manifests[save_path] = manifest
+        return manifest
+
+    def export(self, chart, data, user_id, save_path='outputs/plots'):
+        """
+        Write the chart to save_path/{user_id}_{chart}.png in the background.
+        The future returns the file path, or None if there was nothing to
+        draw; the file is left alone if it already holds this exact chart.
+        """
+        key = chart_key(chart, data, user_id)
+        file_name = f"{user_id}_{chart}.png"
+        path = os.path.join(save_path, file_name)
+
+        with self._lock:
+            if self._manifest(save_path).get(file_name) == key and os.path.exists(path):
+                self.hits += 1
+                return _done(path)
+
+        # Written from the render's completion callback rather than another pool
+        # task, so a write never occupies a worker while waiting for a render
+        written = Future()
+
+        def write(rendered):
+            try:
+                written.set_result(self._write(rendered.result(), key, save_path, file_name))
+            except Exception as e:
+                written.set_exception(e)
+
+        self.submit(chart, data, user_id).add_done_callback(write)
+        return written
+
+    def _write(self, png, key, save_path, file_name):
+        if png is None:
+            return None
+        path = os.path.join(save_path, file_name)
+        os.makedirs(save_path, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(png)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            self.writes += 1
+            manifest = self._manifest(save_path)
+            manifest[file_name] = key
+            with open(os.path.join(save_path, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=4)
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._pngs),
+                'renders': self.renders,
+                'hits': self.hits,
+                'writes': self.writes,
+                'pending': len(self._pending)
+            }
+
+def _done(value):
+    # Already-finished future, so callers can treat hits and renders alike
+    future = Future()
+    future.set_result(value)
+    return future
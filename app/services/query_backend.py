@@ -0,0 +1,283 @@
+import numpy as np
+import pandas as pd
+from app.services import aggregation
+from app.services.anomaly_detector import ANOMALY_COLUMNS, detect_duplicates, spending_spike_thresholds
+
+ENGINES = ('pandas', 'duckdb')
+
+def get_backend(source, engine='pandas', user_id=None, start=None, end=None, threads=None):
+    """
+    Query backend over the cleaned data: a DataFrame or a Parquet file (see
+    data_loader.cleaned_parquet), optionally restricted to one user and a
+    TXN_DATE range.
+
+    engine='pandas' (default) runs the aggregation.py / anomaly_detector.py
+    functions; engine='duckdb' runs the same queries in DuckDB, multi-threaded
+    and reading only the columns and row groups it needs, with identical
+    output. Falls back to pandas if duckdb is not installed.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}.")
+    if engine == 'duckdb':
+        try:
+            return DuckDBBackend(source, user_id, start, end, threads)
+        except ImportError:
+            print("Warning: duckdb is not installed, using the pandas backend.")
+    return PandasBackend(source, user_id, start, end)
+
+class PandasBackend:
+    """
+    Reference backend: loads only the needed columns (Parquet row filters
+    are pushed down to pyarrow) and calls the pandas implementations.
+
+    With a date range, rolling spend and recurring payments only see the
+    rows inside it (no history from before start).
+    """
+
+    name = 'pandas'
+
+    def __init__(self, source, user_id=None, start=None, end=None):
+        self.source = source
+        self.user_id = user_id
+        self.start = start
+        self.end = end
+
+    def _frame(self, columns):
+        if isinstance(self.source, pd.DataFrame):
+            df = self.source[[col for col in columns if col in self.source.columns]]
+            mask = np.ones(len(df), dtype=bool)
+            if self.user_id is not None:
+                mask &= (self.source['UserID'] == self.user_id).to_numpy()
+            if self.start is not None:
+                mask &= (self.source['TXN_DATE'] >= pd.Timestamp(self.start)).to_numpy()
+            if self.end is not None:
+                mask &= (self.source['TXN_DATE'] <= pd.Timestamp(self.end)).to_numpy()
+            return df if mask.all() else df[mask]
+
+        filters = []
+        if self.user_id is not None:
+            filters.append(('UserID', '==', self.user_id))
+        if self.start is not None:
+            filters.append(('TXN_DATE', '>=', pd.Timestamp(self.start)))
+        if self.end is not None:
+            filters.append(('TXN_DATE', '<=', pd.Timestamp(self.end)))
+        available = set(_empty_like_source(self.source).columns)
+        return pd.read_parquet(self.source, columns=[col for col in columns if col in available],
+                               filters=filters or None)
+
+    def calculate_total_spend(self):
+        return aggregation.calculate_total_spend(self._frame(['UserID', 'TXN_AMOUNT']))
+
+    def analyze_monthly_spend(self):
+        return aggregation.analyze_monthly_spend(self._frame(['UserID', 'YearMonth', 'TXN_AMOUNT']))
+
+    def spend_by_transaction_type(self):
+        return aggregation.spend_by_transaction_type(self._frame(['TXN_TYPE', 'TXN_AMOUNT']))
+
+    def transaction_frequency(self):
+        return aggregation.transaction_frequency(self._frame(['UserID', 'TXN_AMOUNT']))
+
+    def temporal_spend_trends(self):
+        return aggregation.temporal_spend_trends(self._frame(['TXN_DATE', 'TXN_AMOUNT']))
+
+    def weekday_vs_weekend_spend(self):
+        return aggregation.weekday_vs_weekend_spend(self._frame(['Weekend', 'TXN_AMOUNT']))
+
+    def peak_spending_hours(self):
+        return aggregation.peak_spending_hours(self._frame(['Hour', 'TXN_AMOUNT']))
+
+    def currency_spend_breakdown(self):
+        return aggregation.currency_spend_breakdown(self._frame(['CURRENCY', 'TXN_AMOUNT']))
+
+    def fee_analysis(self):
+        return aggregation.fee_analysis(self._frame(['FEE_AMOUNT', 'Fee_to_Txn_Ratio']))
+
+    def build_merchant_table(self):
+        return aggregation.build_merchant_table(self._frame(['UserID', 'MERC_TXN_ID', 'TXN_AMOUNT']))
+
+    def top_merchants(self, top_n=10):
+        return aggregation.top_merchants(None, top_n=top_n, merchant_table=self.build_merchant_table())
+
+    def calculate_rolling_spend(self, window=7):
+        return aggregation.calculate_rolling_spend(self._frame(['UserID', 'TXN_DATE', 'TXN_AMOUNT']), window)
+
+    def detect_recurring_payments(self, interval_days=30, tolerance_days=5):
+        return aggregation.detect_recurring_payments(self._frame(['UserID', 'MERC_TXN_ID', 'TXN_DATE']),
+                                                     interval_days, tolerance_days)
+
+    def spending_spike_thresholds(self, percentile_thresholds=(95,)):
+        return spending_spike_thresholds(self._frame(['UserID', 'TXN_AMOUNT']), percentile_thresholds)
+
+    def detect_duplicates(self):
+        """
+        Exact duplicates (UserID + TXN_DATE + MERC_TXN_ID + TXN_AMOUNT) as
+        ANOMALY_COLUMNS + Anomaly_Type, in source order with a fresh index.
+        """
+        dupes = detect_duplicates(self._frame(ANOMALY_COLUMNS))
+        return dupes[ANOMALY_COLUMNS + ['Anomaly_Type']].reset_index(drop=True)
+
+def _empty_like_source(source):
+    # Zero-row frame with the source's pandas dtypes (categoricals included)
+    if isinstance(source, pd.DataFrame):
+        return source.iloc[:0]
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    # The schema alone has no categories; read the (dictionary-encoded, cheap)
+    # categorical columns so they match what pd.read_parquet would return
+    schema = pq.read_schema(source)
+    categorical = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+    empty = schema.empty_table().to_pandas()
+    if categorical:
+        categories = pd.read_parquet(source, columns=categorical)
+        empty = empty.astype({col: categories[col].dtype for col in categorical})
+    return empty
+
+class DuckDBBackend(PandasBackend):
+    """
+    Same queries in DuckDB. Each result is cast to the dtypes the pandas
+    implementation returns for this source, so both backends compare equal.
+
+    calculate_rolling_spend and detect_recurring_payments work on each
+    user's ordered rows with the vectorized NumPy passes in aggregation.py;
+    they are inherited from PandasBackend and stay on the pandas path
+    (still reading only their columns and row groups).
+    """
+
+    name = 'duckdb'
+
+    def __init__(self, source, user_id=None, start=None, end=None, threads=None):
+        import duckdb
+
+        super().__init__(source, user_id, start, end)
+        self.conn = duckdb.connect()
+        if threads:
+            self.conn.execute(f"SET threads TO {int(threads)}")
+
+        self._empty = _empty_like_source(source)
+        if isinstance(source, pd.DataFrame):
+            # DuckDB cannot scan Period columns; YearMonth is derived from TXN_DATE instead
+            columns = [col for col, dtype in source.dtypes.items() if not isinstance(dtype, pd.PeriodDtype)]
+            self.conn.register('source_df', source[columns])
+            self._relation = 'source_df'
+        else:
+            self._relation = "read_parquet(?)"
+
+    def _query(self, select, where=(), group_by=None, order_by=None, qualify=None, relation=None):
+        conditions = list(where)
+        params = [] if isinstance(self.source, pd.DataFrame) else [self.source]
+        if self.user_id is not None:
+            conditions.append("UserID = ?")
+            params.append(str(self.user_id))
+        if self.start is not None:
+            conditions.append("TXN_DATE >= ?")
+            params.append(pd.Timestamp(self.start).to_pydatetime())
+        if self.end is not None:
+            conditions.append("TXN_DATE <= ?")
+            params.append(pd.Timestamp(self.end).to_pydatetime())
+
+        sql = f"SELECT {select} FROM {relation or self._relation}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if group_by:
+            sql += f" GROUP BY {group_by}"
+        if qualify:
+            sql += f" QUALIFY {qualify}"
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        return self.conn.execute(sql, params).df()
+
+    def _like(self, result, reference):
+        # pandas groupby sorts keys and drops missing ones; match its dtypes too
+        result.columns = reference.columns
+        return result.astype(reference.dtypes.to_dict())
+
+    def _grouped_sum(self, key, name, reference):
+        result = self._query(f"{key}, SUM(TXN_AMOUNT) AS {name}", where=[f"{key} IS NOT NULL"],
+                             group_by=key, order_by=key)
+        return self._like(result, reference)
+
+    def calculate_total_spend(self):
+        return self._grouped_sum('UserID', 'Total_Spend', aggregation.calculate_total_spend(self._empty))
+
+    def analyze_monthly_spend(self):
+        result = self._query(
+            "UserID, strftime(TXN_DATE, '%Y-%m') AS YearMonth, SUM(TXN_AMOUNT) AS Monthly_Spend",
+            where=["UserID IS NOT NULL", "TXN_DATE IS NOT NULL"], group_by="1, 2", order_by="1, 2")
+        return self._like(result, aggregation.analyze_monthly_spend(self._empty))
+
+    def spend_by_transaction_type(self):
+        return self._grouped_sum('TXN_TYPE', 'Total_Spend', aggregation.spend_by_transaction_type(self._empty))
+
+    def transaction_frequency(self):
+        result = self._query("UserID, COUNT(*) AS Transaction_Count, AVG(TXN_AMOUNT) AS Average_Transaction_Value",
+                             where=["UserID IS NOT NULL"], group_by="UserID", order_by="UserID")
+        return self._like(result, aggregation.transaction_frequency(self._empty))
+
+    def temporal_spend_trends(self):
+        daily_ref, weekly_ref, monthly_ref = aggregation.temporal_spend_trends(self._empty)
+        where = ["TXN_DATE IS NOT NULL"]
+        daily = self._query("CAST(TXN_DATE AS DATE) AS day, SUM(TXN_AMOUNT) AS Daily_Spend",
+                            where=where, group_by="1", order_by="1")
+        # pandas keys are datetime.date objects and Periods
+        daily['day'] = pd.to_datetime(daily['day']).dt.date
+        weekly = self._query("week(TXN_DATE) AS week, SUM(TXN_AMOUNT) AS Weekly_Spend",
+                             where=where, group_by="1", order_by="1")
+        monthly = self._query("date_trunc('month', TXN_DATE) AS month, SUM(TXN_AMOUNT) AS Monthly_Spend",
+                              where=where, group_by="1", order_by="1")
+        monthly['month'] = pd.to_datetime(monthly['month']).dt.to_period('M')
+        return self._like(daily, daily_ref), self._like(weekly, weekly_ref), self._like(monthly, monthly_ref)
+
+    def weekday_vs_weekend_spend(self):
+        result = self._query(
+            "CASE Weekend WHEN 0 THEN 'Weekday' WHEN 1 THEN 'Weekend' END AS Day_Type, SUM(TXN_AMOUNT) AS TXN_AMOUNT",
+            where=["Weekend IS NOT NULL"], group_by="Weekend", order_by="Weekend")
+        return self._like(result, aggregation.weekday_vs_weekend_spend(self._empty))
+
+    def peak_spending_hours(self):
+        return self._grouped_sum('Hour', 'Total_Spend', aggregation.peak_spending_hours(self._empty))
+
+    def currency_spend_breakdown(self):
+        if 'CURRENCY' not in self._empty.columns:
+            return pd.DataFrame()
+        return self._grouped_sum('CURRENCY', 'Total_Spend', aggregation.currency_spend_breakdown(self._empty))
+
+    def fee_analysis(self):
+        total_fees, avg_fee_ratio = self._query(
+            "COALESCE(SUM(FEE_AMOUNT), 0), AVG(Fee_to_Txn_Ratio)").iloc[0]
+        # Same scalar types as pandas; the mean may differ in the last bit (summation order)
+        total_fees = type(aggregation.fee_analysis(self._empty)[0])(total_fees)
+        return total_fees, self._empty['Fee_to_Txn_Ratio'].dtype.type(avg_fee_ratio)
+
+    def build_merchant_table(self):
+        result = self._query(
+            "UserID, MERC_TXN_ID, COUNT(*) AS Transaction_Count, SUM(TXN_AMOUNT) AS Total_Spend",
+            where=["UserID IS NOT NULL", "MERC_TXN_ID IS NOT NULL"],
+            group_by="UserID, MERC_TXN_ID", order_by="UserID, MERC_TXN_ID")
+        return self._like(result, aggregation.build_merchant_table(self._empty))
+
+    def spending_spike_thresholds(self, percentile_thresholds=(95,)):
+        percentile_thresholds = list(percentile_thresholds)
+        quantiles = ', '.join(str(p / 100) for p in percentile_thresholds)
+        result = self._query(f"UserID, quantile_cont(TXN_AMOUNT, [{quantiles}]) AS q",
+                             where=["UserID IS NOT NULL", "NOT isnan(TXN_AMOUNT)"],
+                             group_by="UserID", order_by="UserID")
+        reference = spending_spike_thresholds(self._empty, percentile_thresholds)
+        values = np.array(result['q'].tolist(), dtype=float).reshape(len(result), len(percentile_thresholds))
+        index = pd.Index(result['UserID'].astype(reference.index.dtype), name='UserID')
+        return pd.DataFrame(values, index=index, columns=percentile_thresholds)
+
+    def detect_duplicates(self):
+        keys = ', '.join(ANOMALY_COLUMNS)
+        if isinstance(self.source, pd.DataFrame):
+            rows = self.source[ANOMALY_COLUMNS].assign(source_row=np.arange(len(self.source)))
+            self.conn.register('source_rows', rows)
+            relation, row_number = 'source_rows', 'source_row'
+        else:
+            relation, row_number = "read_parquet(?, file_row_number = true)", 'file_row_number'
+
+        # Copies share UserID and TXN_DATE, so the user / date filters cannot split a group
+        result = self._query(f"{keys}, 'Duplicate Transaction' AS Anomaly_Type",
+                             qualify=f"COUNT(*) OVER (PARTITION BY {keys}) > 1",
+                             order_by=row_number, relation=relation)
+        reference = detect_duplicates(self._empty[ANOMALY_COLUMNS])
+        return self._like(result, reference[ANOMALY_COLUMNS + ['Anomaly_Type']])
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import argparse
+import matplotlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app.services.data_loader import load_and_clean_data
+from app.services.aggregation import (
+    analyze_monthly_spend,
+    binned_amount_distribution,
+    build_merchant_table,
+    top_merchants
+)
+from app.services.visualization import CHARTS, figure_png
+from app.services.instrumentation import instrumented
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _init_worker():
+    # Headless: no GUI backend, nothing shown
+    matplotlib.use('Agg')
+
+@instrumented
+def _render_batch(batch, output_dir, charts):
+    """
+    Render the charts for a batch of (user_id, {chart: data}) pairs and
+    write them as output_dir/{user_id}_{chart}.png. Each figure is cleared
+    once written, so worker memory does not grow with the number of users.
+    """
+    started = time.perf_counter()
+    written = 0
+    for user_id, chart_data in batch:
+        for chart in charts:
+            fig = CHARTS[chart][0](chart_data[chart], user_id)
+            if fig is None:
+                continue
+            path = os.path.join(output_dir, f"{user_id}_{chart}.png")
+            with open(path + '.tmp', 'wb') as f:
+                f.write(figure_png(fig))
+            os.replace(path + '.tmp', path)
+            fig.clear()
+            written += 1
+    return {
+        'users': len(batch),
+        'charts': written,
+        'seconds': time.perf_counter() - started,
+        'peak_rss_mb': _peak_rss_mb()
+    }
+
+def _user_chart_data(df, user_index, users):
+    """
+    Pre-aggregated inputs of every chart for each user, so workers receive
+    and draw a bounded number of points per chart. Monthly, hourly and top
+    merchant figures are aggregated once for all users and then split.
+    """
+    monthly = analyze_monthly_spend(df)
+    _, top_value = top_merchants(None, top_n=10, merchant_table=build_merchant_table(df))
+    hourly = (
+        df.groupby(['UserID', 'Hour'], observed=True)['TXN_AMOUNT']
+        .sum()
+        .reset_index()
+        .rename(columns={'TXN_AMOUNT': 'Total_Spend'})
+    )
+    monthly_by_user = dict(tuple(monthly.groupby('UserID', observed=True, sort=False)))
+    merchants_by_user = dict(tuple(top_value.groupby('UserID', observed=True, sort=False)))
+    hourly_by_user = dict(tuple(hourly.groupby('UserID', observed=True, sort=False)))
+
+    for user_id in users:
+        yield user_id, {
+            'monthly_spend': monthly_by_user.get(user_id, monthly.iloc[:0]),
+            'top_merchants': merchants_by_user.get(user_id, top_value.iloc[:0]),
+            'transaction_distribution': binned_amount_distribution(user_index.rows(user_id)),
+            'peak_hours': hourly_by_user.get(user_id, hourly.iloc[:0])[['Hour', 'Total_Spend']]
+        }
+
+@instrumented
+def generate_reports(file_path, output_dir='outputs/plots', users=None, charts=None, workers=1,
+                     batch_size=8, cache_dir='outputs/cache', profile='compact'):
+    """
+    Render the standard chart set (visualization.CHARTS) for every user, or
+    only `users`, without Streamlit. Batches of users are drawn on the Agg
+    backend by `workers` processes.
+
+    Prints progress per batch and returns the throughput report (charts/s,
+    peak worker memory), also saved as report_run.json in output_dir.
+    """
+    job_started = time.perf_counter()
+    charts = list(charts or CHARTS)
+    unknown = [chart for chart in charts if chart not in CHARTS]
+    if unknown:
+        raise ValueError(f"Unknown charts {unknown}, expected some of {list(CHARTS)}.")
+
+    started = time.perf_counter()
+    df, user_index = load_and_clean_data(file_path, cache_dir=cache_dir, profile=profile, with_index=True)
+    load_seconds = time.perf_counter() - started
+
+    if users is None:
+        users = user_index.users
+    else:
+        missing = [user_id for user_id in users if user_id not in user_index]
+        if missing:
+            print(f"Warning: no transactions for {len(missing)} requested users: {missing[:5]}")
+        users = [user_id for user_id in users if user_id in user_index]
+
+    os.makedirs(output_dir, exist_ok=True)
+    chart_data = list(_user_chart_data(df, user_index, users))
+    batches = [chart_data[i:i + batch_size] for i in range(0, len(chart_data), batch_size)]
+
+    results = []
+    started = time.perf_counter()
+
+    def report(result):
+        results.append(result)
+        print(f"[{len(results)}/{len(batches)}] {result['users']} users, {result['charts']} charts "
+              f"({result['seconds']:.2f}s)")
+
+    if workers == 1 or len(batches) <= 1:
+        _init_worker()
+        for batch in batches:
+            report(_render_batch(batch, output_dir, charts))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(_render_batch, batch, output_dir, charts) for batch in batches]
+            for future in as_completed(futures):
+                report(future.result())
+
+    render_seconds = time.perf_counter() - started
+    written = sum(result['charts'] for result in results)
+    peak_rss = [result['peak_rss_mb'] for result in results if result['peak_rss_mb'] is not None]
+
+    run_report = {
+        'input': file_path,
+        'workers': workers,
+        'users': len(users),
+        'charts': written,
+        'load_seconds': round(load_seconds, 3),
+        'render_seconds': round(render_seconds, 3),
+        'total_seconds': round(time.perf_counter() - job_started, 3),
+        'charts_per_second': round(written / render_seconds, 2) if render_seconds else None,
+        'peak_worker_rss_mb': max(peak_rss) if peak_rss else None
+    }
+    with open(os.path.join(output_dir, 'report_run.json'), 'w') as f:
+        json.dump(run_report, f, indent=4)
+
+    print(f"Rendered {written:,} charts for {len(users):,} users in {render_seconds:.2f}s "
+          f"({run_report['charts_per_second']} charts/s, peak worker RSS {run_report['peak_worker_rss_mb']} MB).")
+    return run_report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the standard charts for every user, headless.")
+    parser.add_argument('--input', default='data/transactions.csv',
+                        help="CSV file, directory or glob of CSV partitions")
+    parser.add_argument('--output', default='outputs/plots', help="Directory for the PNG files")
+    parser.add_argument('--users', nargs='*', default=None, help="Only these UserIDs (default: all)")
+    parser.add_argument('--charts', nargs='*', default=None, choices=list(CHARTS), help="Only these charts")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--batch-size', type=int, default=8, help="Users per worker task")
+    parser.add_argument('--cache-dir', default='outputs/cache', help="Cleaned data cache directory")
+    parser.add_argument('--profile', default='compact', choices=['full', 'compact'])
+    args = parser.parse_args(argv)
+
+    generate_reports(
+        args.input,
+        output_dir=args.output,
+        users=args.users,
+        charts=args.charts,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        cache_dir=args.cache_dir,
+        profile=args.profile
+    )
+
+if __name__ == "__main__":
+    main()
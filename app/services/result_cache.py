@@ -0,0 +1,66 @@
+import time
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    Bounded, expiring memo of analysis results.
+
+    Entries are keyed on whatever determines the result (e.g. UserID, date
+    range, detector parameters and data version), evicted least recently
+    used beyond max_entries and dropped once older than ttl_seconds.
+    Hit / miss / eviction counters are kept for display. Cached values are
+    shared, so callers must not modify them in place.
+    """
+
+    def __init__(self, max_entries=128, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute, *args, **kwargs):
+        """
+        Returns the cached value for key, or calls compute(*args, **kwargs),
+        caches and returns its result.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+
+        # Compute outside the lock so other sessions are not blocked
+        value = compute(*args, **kwargs)
+
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
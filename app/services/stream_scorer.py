@@ -0,0 +1,171 @@
+import os
+import math
+import pickle
+import pandas as pd
+from app.services.anomaly_detector import DUPLICATE_WINDOW
+
+class P2Quantile:
+    """
+    P² streaming quantile estimator (Jain & Chlamtac, 1985).
+
+    Tracks one quantile with five markers, O(1) time and memory per update.
+    Until five observations have been seen the exact (linear) quantile of
+    the stored values is returned.
+    """
+
+    __slots__ = ('p', 'count', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # Find the cell containing x, widening the extremes if needed
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Nudge the three middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self):
+        if self.count == 0:
+            return math.nan
+        if self.count <= 5:
+            q = self.heights
+            h = (len(q) - 1) * self.p
+            lo = int(h)
+            hi = min(lo + 1, len(q) - 1)
+            return q[lo] + (h - lo) * (q[hi] - q[lo])
+        return self.heights[2]
+
+class _UserState:
+    __slots__ = ('quantile', 'buckets')
+
+    def __init__(self, p):
+        self.quantile = P2Quantile(p)
+        # bucket number -> {(MERC_TXN_ID, TXN_AMOUNT): last timestamp in seconds}
+        self.buckets = {}
+
+class StreamingAnomalyScorer:
+    """
+    Event-at-a-time anomaly scorer with compact per-user state.
+
+    - Spending Spike: the amount is at or above the user's streaming
+      percentile (P² estimate over the transactions seen so far), once the
+      user has min_history transactions. The batch detector compares against
+      a quantile that includes the transaction itself; this one scores each
+      event against prior history only.
+    - Duplicate Transaction: the same merchant and amount seen for the user
+      within duplicate_window, using time buckets of that width, so
+      12:00:29 and 12:00:31 match where minute rounding would not.
+
+    State is O(1) per user plus the transactions in the last two buckets,
+    and can be checkpointed to disk and restored.
+    """
+
+    def __init__(self, percentile_threshold=95, duplicate_window=DUPLICATE_WINDOW, min_history=10):
+        self.percentile_threshold = percentile_threshold
+        self.window = pd.Timedelta(duplicate_window).total_seconds()
+        self.min_history = min_history
+        self.users = {}
+        self.events = 0
+
+    def process(self, txn):
+        """
+        Score one transaction (a mapping with UserID, TXN_DATE, TXN_AMOUNT and
+        MERC_TXN_ID), update the user's state, and return the anomaly flags.
+        """
+        user_id = txn['UserID']
+        amount = float(txn['TXN_AMOUNT'])
+        ts = pd.Timestamp(txn['TXN_DATE']).timestamp()
+
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = _UserState(self.percentile_threshold / 100)
+
+        quantile = state.quantile
+        is_spike = quantile.count >= self.min_history and amount >= quantile.value()
+        quantile.add(amount)
+
+        key = (txn.get('MERC_TXN_ID'), amount)
+        bucket = int(ts // self.window)
+        is_duplicate = False
+        for b in (bucket - 1, bucket, bucket + 1):
+            seen = state.buckets.get(b)
+            if seen is not None and key in seen and abs(ts - seen[key]) <= self.window:
+                is_duplicate = True
+                break
+
+        state.buckets.setdefault(bucket, {})[key] = ts
+        if len(state.buckets) > 2:
+            # Only the current and previous bucket can still match
+            for b in [b for b in state.buckets if b < bucket - 1]:
+                del state.buckets[b]
+
+        self.events += 1
+        return {'Spending Spike': is_spike, 'Duplicate Transaction': is_duplicate}
+
+    def replay(self, df):
+        """
+        Feed a frame through process() in TXN_DATE order, e.g. to warm the
+        state from history. Returns the flags as a DataFrame aligned to df.
+        """
+        ordered = df.sort_values('TXN_DATE', kind='mergesort')
+        columns = ['UserID', 'TXN_DATE', 'TXN_AMOUNT', 'MERC_TXN_ID']
+        flags = [self.process(dict(zip(columns, row))) for row in ordered[columns].itertuples(index=False)]
+        return pd.DataFrame(flags, index=ordered.index).reindex(df.index)
+
+    def checkpoint(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def restore(cls, path):
+        with open(path, 'rb') as f:
+            scorer = pickle.load(f)
+        if not isinstance(scorer, cls):
+            raise TypeError(f"{path} does not contain a {cls.__name__} checkpoint.")
+        return scorer
@@ -0,0 +1,87 @@
+import os
+import sys
+
+import pandas as pd
+
+# Run from this directory or with pytest; make the repo root importable for app.services.*
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app.services.anomaly_detector import duplicate_clusters, merge_anomalies, summarize_anomalies
+
+def _transactions(rows):
+    return pd.DataFrame(rows, columns=['UserID', 'MERC_TXN_ID', 'TXN_AMOUNT', 'TXN_DATE']).assign(
+        TXN_DATE=lambda df: pd.to_datetime(df['TXN_DATE'])
+    )
+
+def test_duplicate_clusters():
+    df = _transactions([
+        # Either side of a minute boundary: one cluster (minute rounding splits them)
+        ('u1', 'M1', 10.0, '2024-01-01 12:00:29'),
+        ('u1', 'M1', 10.0, '2024-01-01 12:00:31'),
+        # Chain: each within 60s of the previous, 100s end to end
+        ('u1', 'M2', 20.0, '2024-01-01 13:00:00'),
+        ('u1', 'M2', 20.0, '2024-01-01 13:00:50'),
+        ('u1', 'M2', 20.0, '2024-01-01 13:01:40'),
+        # Exactly the window apart still matches
+        ('u1', 'M3', 30.0, '2024-01-01 14:00:00'),
+        ('u1', 'M3', 30.0, '2024-01-01 14:01:00'),
+        # Outside the window
+        ('u1', 'M4', 40.0, '2024-01-01 15:00:00'),
+        ('u1', 'M4', 40.0, '2024-01-01 15:01:01'),
+        # Same merchant, amount and time as the first pair, other user / amount
+        ('u2', 'M1', 10.0, '2024-01-01 12:00:30'),
+        ('u1', 'M1', 11.0, '2024-01-01 12:00:30'),
+    ])
+
+    clusters = duplicate_clusters(df)  # default window, 60s
+
+    assert clusters.index.equals(df.index)
+    assert clusters[0] == clusters[1] >= 0
+    assert clusters[2] == clusters[3] == clusters[4] >= 0
+    assert clusters[5] == clusters[6] >= 0
+    assert len({clusters[0], clusters[2], clusters[5]}) == 3
+    assert (clusters[7:] == -1).all()
+
+    # A narrower window breaks the chain and the boundary pair
+    clusters = duplicate_clusters(df, window='30s')
+    assert clusters[0] == clusters[1] >= 0
+    assert (clusters[2:] == -1).all()
+
+def _found(df, rows, anomaly_type, **columns):
+    return df.loc[rows].assign(Anomaly_Type=anomaly_type, **columns)
+
+def test_merge_anomalies():
+    df = _transactions([
+        ('u1', 'M1', 500.0, '2024-01-01 10:00:00'),
+        ('u1', 'M2', 900.0, '2024-01-02 10:00:00'),
+        ('u1', 'M3', 300.0, '2024-01-03 10:00:00'),
+        # Exact copies: one merged row each
+        ('u1', 'M4', 50.0, '2024-01-04 09:00:00'),
+        ('u1', 'M4', 50.0, '2024-01-04 09:00:00'),
+        ('u2', 'M5', 70.0, '2024-02-01 10:00:00'),
+        ('u2', 'M6', 5.0, '2024-02-02 10:00:00'),
+    ])
+    outliers = _found(df, [0, 1, 5], 'Outlier')
+    spikes = _found(df, [1, 2, 3, 5], 'Spending Spike')
+    duplicates = _found(df, [3, 4, 5], 'Duplicate Transaction', Duplicate_Cluster=[0, 0, 1])
+
+    merged = merge_anomalies(outliers, spikes, duplicates)
+
+    assert merged['Anomaly_Flags'].tolist() == [1, 1 | 2, 2, 2 | 4, 4, 1 | 2 | 4]
+    assert merged['Anomaly_Type'].tolist()[3:5] == ['Duplicate Transaction; Spending Spike', 'Duplicate Transaction']
+    assert merged[['UserID', 'MERC_TXN_ID']].values.tolist() == [
+        ['u1', 'M1'], ['u1', 'M2'], ['u1', 'M3'], ['u1', 'M4'], ['u1', 'M4'], ['u2', 'M5']
+    ]
+    assert merged['Duplicate_Cluster'].fillna(-1).tolist() == [-1, -1, -1, 0, 0, 1]
+
+    summary = summarize_anomalies(merged)
+    counts = {(row.UserID, row.Anomaly_Type): row.Anomaly_Count for row in summary.itertuples()}
+    assert counts == {
+        ('u1', 'Duplicate Transaction'): 2, ('u1', 'Outlier'): 2, ('u1', 'Spending Spike'): 3,
+        ('u2', 'Duplicate Transaction'): 1, ('u2', 'Outlier'): 1, ('u2', 'Spending Spike'): 1,
+    }
+
+if __name__ == "__main__":
+    test_duplicate_clusters()
+    test_merge_anomalies()
+    print("anomaly detector checks passed")
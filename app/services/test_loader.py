@@ -1,5 +1,12 @@
-from data_loader import load_and_clean_data
-from aggregation import (
+import os
+import sys
+
+# Run from this directory; make the repo root importable for app.services.*
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from app.services.data_loader import load_and_clean_data
+from app.services.aggregation import (
+    build_rollup,
     calculate_total_spend,
     analyze_monthly_spend,
     transaction_amount_distribution,
@@ -12,7 +19,7 @@ from aggregation import (
     currency_spend_breakdown,
     fee_analysis
 )
-from visualization import (
+from app.services.visualization import (
     plot_monthly_spend,
     plot_top_merchants,
     plot_transaction_distribution,
@@ -22,20 +29,22 @@ from visualization import (
 if __name__ == "__main__":
     # Load data
     df = load_and_clean_data('../../data/transactions.csv')
-    # Aggregations
-    total_spend = calculate_total_spend(df)
-    monthly_spend = analyze_monthly_spend(df)
-    txn_type_spend = spend_by_transaction_type(df)
-    top_volume, top_value = top_merchants(df)
-    frequency = transaction_frequency(df)
-    daily_spend, weekly_spend, monthly_spend_trends = temporal_spend_trends(df)
-    weekend_spend = weekday_vs_weekend_spend(df)
-    peak_hours = peak_spending_hours(df)
-    currency_breakdown = currency_spend_breakdown(df)
-    total_fees, avg_fee_ratio = fee_analysis(df)
+    # Aggregations (answered from the rollup cube, built in one pass)
+    cube = build_rollup(df)
+    total_spend = calculate_total_spend(cube)
+    monthly_spend = analyze_monthly_spend(cube)
+    txn_type_spend = spend_by_transaction_type(cube)
+    top_volume, top_value = top_merchants(cube)
+    frequency = transaction_frequency(cube)
+    daily_spend, weekly_spend, monthly_spend_trends = temporal_spend_trends(cube)
+    weekend_spend = weekday_vs_weekend_spend(cube)
+    peak_hours = peak_spending_hours(cube)
+    currency_breakdown = currency_spend_breakdown(cube)
+    total_fees, avg_fee_ratio = fee_analysis(cube)
 
-    # Choose a User ID to plot (change as needed)
-    user_id = 'System'  # Example UserID from your dataset
+    # Choose a User ID to plot: first argument, default 'System'
+    # (for every user, run report_generator.py instead)
+    user_id = sys.argv[1] if len(sys.argv) > 1 else 'System'
 
     # Visualizations (All forced per user)
     plot_monthly_spend(monthly_spend, user_id)
@@ -1,17 +1,26 @@
-import matplotlib.pyplot as plt
+import io
 import seaborn as sns
 import streamlit as st
 import os
 import pandas as pd
+from matplotlib.figure import Figure
 from matplotlib.ticker import FuncFormatter
 import numpy as np
+from app.services.aggregation import binned_amount_distribution
+from app.services.instrumentation import instrumented
 
 sns.set(style="whitegrid")
 
-def plot_monthly_spend(monthly_spend, user_id, save_path=None):
+# Same defaults st.pyplot uses, so cached PNGs look like the live charts
+PNG_OPTIONS = {'format': 'png', 'dpi': 200, 'bbox_inches': 'tight'}
+
+# The *_figure functions below draw on their own Figure (no pyplot state),
+# so they are safe to call from worker threads and need no plt.close().
+
+@instrumented
+def monthly_spend_figure(monthly_spend, user_id):
     if monthly_spend.empty:
-        st.warning("No monthly spend data available.")
-        return
+        return None
 
     data = monthly_spend[monthly_spend['UserID'] == user_id].copy()
     data['YearMonth'] = pd.to_datetime(data['YearMonth'])
@@ -22,13 +31,14 @@ def plot_monthly_spend(monthly_spend, user_id, save_path=None):
     # Add 3-month rolling average
     data['Rolling_Avg'] = data['Monthly_Spend'].rolling(window=3).mean()
 
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
     sns.lineplot(x='YearMonth', y='Monthly_Spend', data=data, marker='o', ax=ax, label='Monthly Spend')
     sns.lineplot(x='YearMonth', y='Rolling_Avg', data=data, linestyle='--', ax=ax, label='3-Month Avg')
-    plt.title(f"Monthly Spending Trend {subtitle}", fontsize=14)
-    plt.xlabel("Month")
-    plt.ylabel("Spend")
-    plt.xticks(rotation=45)
+    ax.set_title(f"Monthly Spending Trend {subtitle}", fontsize=14)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Spend")
+    ax.tick_params(axis='x', labelrotation=45)
 
     if len(data) > 1:
         peak = data.loc[data['Monthly_Spend'].idxmax()]
@@ -41,21 +51,17 @@ def plot_monthly_spend(monthly_spend, user_id, save_path=None):
     ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f"${x:,.0f}"))
     ax.set_ylim(bottom=0)
     ax.legend()
-    plt.tight_layout()
-
-    if save_path:
-        os.makedirs(save_path, exist_ok=True)
-        plt.savefig(os.path.join(save_path, f"{user_id}_monthly_spend.png"))
-    st.pyplot(fig)
-    plt.clf()
+    fig.tight_layout()
+    return fig
 
-def plot_top_merchants(top_merchants, user_id, save_path=None):
+@instrumented
+def top_merchants_figure(top_merchants, user_id):
     data = top_merchants[top_merchants['UserID'] == user_id]
     if data.empty:
-        st.warning("No merchant data available.")
-        return
+        return None
 
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
     data = data.sort_values('Total_Spend', ascending=True)
 
     display_labels = [
@@ -64,9 +70,9 @@ def plot_top_merchants(top_merchants, user_id, save_path=None):
     ]
 
     sns.barplot(x='Total_Spend', y='MERC_TXN_ID', data=data, palette='viridis', ax=ax)
-    plt.title("Top Merchants by Spend")
-    plt.xlabel("Total Spend")
-    plt.ylabel("Merchant")
+    ax.set_title("Top Merchants by Spend")
+    ax.set_xlabel("Total Spend")
+    ax.set_ylabel("Merchant")
 
     for i, (value, label) in enumerate(zip(data['Total_Spend'], display_labels)):
         ax.text(value, i, label, va='center')
@@ -74,26 +80,34 @@ def plot_top_merchants(top_merchants, user_id, save_path=None):
     ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f"${x:,.0f}"))
     ax.set_xlim(left=0)
 
-    plt.tight_layout()
-    if save_path:
-        os.makedirs(save_path, exist_ok=True)
-        plt.savefig(os.path.join(save_path, f"{user_id}_top_merchants.png"))
-    st.pyplot(fig)
-    plt.clf()
-
-def plot_transaction_distribution(user_df, user_id, save_path=None):
-    if user_df.empty:
-        st.warning("No transaction data to display distribution.")
-        return
-
-    fig, ax = plt.subplots(figsize=(10, 5))
-    sns.histplot(user_df['TXN_AMOUNT'], bins=30, kde=True, ax=ax)
-    plt.title("Transaction Amount Distribution")
-    plt.xlabel("Transaction Amount")
-    plt.ylabel("Frequency")
-
-    mean = user_df['TXN_AMOUNT'].mean()
-    median = user_df['TXN_AMOUNT'].median()
+    fig.tight_layout()
+    return fig
+
+@instrumented
+def transaction_distribution_figure(user_df, user_id):
+    # Accepts raw transactions or binned_amount_distribution() output; either
+    # way only the bins and KDE grid are drawn, not every transaction
+    distribution = user_df if 'Part' in user_df.columns else binned_amount_distribution(user_df)
+    if distribution.empty:
+        return None
+
+    bins = distribution[distribution['Part'] == 'bin']
+    kde = distribution[distribution['Part'] == 'kde']
+    stats = distribution.set_index('Part')['X']
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    color = sns.color_palette()[0]
+    ax.bar(bins['X'], bins['Y'], width=bins['X_End'] - bins['X'], align='edge',
+           color=(*color, 0.5), edgecolor='white', linewidth=1)
+    if not kde.empty:
+        ax.plot(kde['X'], kde['Y'], color=color, linewidth=1.5)
+    ax.set_title("Transaction Amount Distribution")
+    ax.set_xlabel("Transaction Amount")
+    ax.set_ylabel("Frequency")
+
+    mean = stats['mean']
+    median = stats['median']
     ax.axvline(mean, color='green', linestyle='--', label=f"Mean: ${mean:,.2f}")
     ax.axvline(median, color='red', linestyle='--', label=f"Median: ${median:,.2f}")
     ax.fill_betweenx([0, ax.get_ylim()[1]], min(mean, median), max(mean, median), color='gray', alpha=0.2)
@@ -102,27 +116,28 @@ def plot_transaction_distribution(user_df, user_id, save_path=None):
     ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f"${x:,.0f}"))
     ax.set_xlim(left=0)
 
-    plt.tight_layout()
-    if save_path:
-        os.makedirs(save_path, exist_ok=True)
-        plt.savefig(os.path.join(save_path, f"{user_id}_transaction_distribution.png"))
-    st.pyplot(fig)
-    plt.clf()
+    fig.tight_layout()
+    return fig
 
-def plot_peak_hours(user_df, user_id, save_path=None):
+@instrumented
+def peak_hours_figure(user_df, user_id):
+    # Accepts raw transactions or peak_spending_hours() output (Hour, Total_Spend)
     if 'Hour' not in user_df.columns:
-        st.warning("Missing Hour column in data.")
-        return
+        return None
 
-    hourly_spend = user_df.groupby('Hour')['TXN_AMOUNT'].sum().reset_index()
+    if 'Total_Spend' in user_df.columns:
+        hourly_spend = user_df[['Hour', 'Total_Spend']].rename(columns={'Total_Spend': 'TXN_AMOUNT'})
+    else:
+        hourly_spend = user_df.groupby('Hour')['TXN_AMOUNT'].sum().reset_index()
     total = hourly_spend['TXN_AMOUNT'].sum()
     hourly_spend['Pct'] = hourly_spend['TXN_AMOUNT'] / total * 100
 
-    fig, ax = plt.subplots(figsize=(10, 5))
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
     sns.barplot(x='Hour', y='TXN_AMOUNT', data=hourly_spend, palette='coolwarm', ax=ax)
-    plt.title("Peak Spending Hours")
-    plt.xlabel("Hour of Day")
-    plt.ylabel("Spend")
+    ax.set_title("Peak Spending Hours")
+    ax.set_xlabel("Hour of Day")
+    ax.set_ylabel("Spend")
 
     peak = hourly_spend.loc[hourly_spend['TXN_AMOUNT'].idxmax()]
     low = hourly_spend.loc[hourly_spend['TXN_AMOUNT'].idxmin()]
@@ -138,9 +153,47 @@ def plot_peak_hours(user_df, user_id, save_path=None):
     ax.yaxis.set_major_formatter(FuncFormatter(lambda x, _: f"${x:,.0f}"))
     ax.set_ylim(bottom=0)
 
-    plt.tight_layout()
+    fig.tight_layout()
+    return fig
+
+# Chart name -> (figure function, columns it reads, message when there is nothing to draw).
+# Charts take raw or pre-aggregated inputs; aggregated ones keep drawing and hashing cheap.
+# Exported files are named f"{user_id}_{name}.png".
+CHARTS = {
+    'monthly_spend': (monthly_spend_figure, ['UserID', 'YearMonth', 'Monthly_Spend'],
+                      "No monthly spend data available."),
+    'top_merchants': (top_merchants_figure, ['UserID', 'MERC_TXN_ID', 'Total_Spend', 'Transaction_Count'],
+                      "No merchant data available."),
+    'transaction_distribution': (transaction_distribution_figure, ['TXN_AMOUNT', 'Part', 'X', 'X_End', 'Y'],
+                                 "No transaction data to display distribution."),
+    'peak_hours': (peak_hours_figure, ['Hour', 'TXN_AMOUNT', 'Total_Spend'], "Missing Hour column in data.")
+}
+
+@instrumented
+def figure_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, **PNG_OPTIONS)
+    return buffer.getvalue()
+
+def _show_chart(chart, data, user_id, save_path=None):
+    figure_function, _, empty_message = CHARTS[chart]
+    fig = figure_function(data, user_id)
+    if fig is None:
+        st.warning(empty_message)
+        return
     if save_path:
         os.makedirs(save_path, exist_ok=True)
-        plt.savefig(os.path.join(save_path, f"{user_id}_peak_hours.png"))
+        fig.savefig(os.path.join(save_path, f"{user_id}_{chart}.png"))
     st.pyplot(fig)
-    plt.clf()
+
+def plot_monthly_spend(monthly_spend, user_id, save_path=None):
+    _show_chart('monthly_spend', monthly_spend, user_id, save_path)
+
+def plot_top_merchants(top_merchants, user_id, save_path=None):
+    _show_chart('top_merchants', top_merchants, user_id, save_path)
+
+def plot_transaction_distribution(user_df, user_id, save_path=None):
+    _show_chart('transaction_distribution', user_df, user_id, save_path)
+
+def plot_peak_hours(user_df, user_id, save_path=None):
+    _show_chart('peak_hours', user_df, user_id, save_path)
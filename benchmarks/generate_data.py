@@ -0,0 +1,196 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+# Header of data/transactions.csv (UserID really does appear twice)
+CSV_COLUMNS = [
+    'ID', 'TXN_ID', 'MERC_TXN_ID', 'PHONE_NO', 'TXN_DATE', 'TXN_NUM', 'TXN_STATUS', 'TXN_AMOUNT',
+    'FEE_AMOUNT', 'TXN_TYPE', 'PAYMENT_TYPE', 'PAYMENT_REF_NO', 'TXN_FAILURE_CODE', 'TXN_FAILURE_TEXT',
+    'PRIMARYFIELD', 'SECONDARYFIELD', 'Fees', 'AUDIT_FIELD8', 'CURRENCY_CODE', 'PHONE_MODEL',
+    'ACCESS_CHANNEL', 'FUTURE_TXN_DATE', 'APP_ID', 'TENANT_ID', 'LAST_ACTION', 'STATUS',
+    'STATUS_CHANGE_DATE', 'UserID', 'CREATED_DATE', 'MODIFIED_BY', 'MODIFIED_DATE', 'VERSION$',
+    'APPLICATION_ID', 'Transaction Type', 'Transaction Reference', 'UserID', 'CIFID', 'AUDIT_FIELD4',
+    'Amount', 'Currency'
+]
+
+# Category mixes roughly as in the sample export
+TXN_TYPES = {'BP': 0.46, 'CCPAY': 0.22, 'TRANSFER': 0.15, 'WITHDRAWAL': 0.15, 'FTO': 0.01, 'FT3P': 0.006,
+             'LOPAY': 0.004}
+CURRENCIES = {'SGD': 0.95, 'AED': 0.02, 'USD': 0.01, 'GBP': 0.01, 'KES': 0.005, 'EUR': 0.005}
+TXN_STATUSES = {'S': 0.6, 'F': 0.2, 'P': 0.2}
+PAYMENT_TYPES = {'Card': 0.34, 'Online': 0.33, 'Cash': 0.33}
+ACCESS_CHANNELS = {'ATM': 0.34, 'MobileApp': 0.33, 'WebPortal': 0.33}
+
+def _zipf_weights(n, skew):
+    # skew=0 is uniform; larger values concentrate activity on the first ids
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def _pick(rng, choices, size):
+    return rng.choice(list(choices), size=size, p=list(choices.values()))
+
+def _chunk(rng, first_id, rows, start, seconds, users, user_weights, user_scale, merchants,
+           merchant_weights, anomaly_rate):
+    user_ids = rng.choice(len(users), size=rows, p=user_weights)
+    dates = start + pd.to_timedelta(np.sort(rng.integers(0, seconds, size=rows)), unit='s')
+    amounts = np.maximum(1, np.round(rng.lognormal(np.log(user_scale[user_ids]), 0.8)))
+
+    # Spending spikes: a share of transactions at 10-50x the user's usual amount
+    spikes = rng.random(rows) < anomaly_rate / 2
+    amounts[spikes] = np.round(amounts[spikes] * rng.uniform(10, 50, spikes.sum()))
+
+    df = pd.DataFrame({
+        'UserID': users[user_ids],
+        'TXN_DATE': dates,
+        'TXN_AMOUNT': amounts,
+        'MERC_TXN_ID': merchants[rng.choice(len(merchants), size=rows, p=merchant_weights)]
+    })
+
+    # Duplicates: copies of a transaction (same user, merchant, amount) 0-30s later
+    duplicates = df[rng.random(rows) < anomaly_rate / 2].copy()
+    duplicates['TXN_DATE'] += pd.to_timedelta(rng.integers(0, 31, size=len(duplicates)), unit='s')
+    df = pd.concat([df, duplicates], ignore_index=True).sort_values('TXN_DATE', kind='mergesort')
+    df = df.reset_index(drop=True)
+
+    n = len(df)
+    ids = np.arange(first_id, first_id + n)
+    id_text = pd.Series(ids).astype(str)
+    date_text = df['TXN_DATE'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    amounts_int = df['TXN_AMOUNT'].astype('int64')
+    txn_ids = 'TXN-' + id_text
+
+    columns = {
+        'ID': ids,
+        'TXN_ID': txn_ids,
+        'MERC_TXN_ID': df['MERC_TXN_ID'],
+        'PHONE_NO': np.nan,
+        'TXN_DATE': date_text,
+        'TXN_NUM': 0,
+        'TXN_STATUS': _pick(rng, TXN_STATUSES, n),
+        'TXN_AMOUNT': amounts_int,
+        'FEE_AMOUNT': rng.integers(0, 100, size=n),
+        'TXN_TYPE': _pick(rng, TXN_TYPES, n),
+        'PAYMENT_TYPE': _pick(rng, PAYMENT_TYPES, n),
+        'PAYMENT_REF_NO': 'REF-' + id_text,
+        'TXN_FAILURE_CODE': np.nan,
+        'TXN_FAILURE_TEXT': np.nan,
+        'PRIMARYFIELD': 'Field1',
+        'SECONDARYFIELD': 'Field2',
+        'Fees': 'Fee-' + pd.Series(rng.integers(1, 11, size=n)).astype(str),
+        'AUDIT_FIELD8': np.nan,
+        'CURRENCY_CODE': _pick(rng, CURRENCIES, n),
+        'PHONE_MODEL': np.nan,
+        'ACCESS_CHANNEL': _pick(rng, ACCESS_CHANNELS, n),
+        'FUTURE_TXN_DATE': np.nan,
+        'APP_ID': rng.integers(1, 10000, size=n),
+        'TENANT_ID': np.nan,
+        'LAST_ACTION': 'Completed',
+        'STATUS': 'Active',
+        'STATUS_CHANGE_DATE': date_text,
+        'UserID': df['UserID'],
+        'CREATED_DATE': date_text,
+        'MODIFIED_BY': 'User',
+        'MODIFIED_DATE': date_text,
+        'VERSION$': 1,
+        'APPLICATION_ID': np.nan,
+        'Transaction Type': 'Billpayment',
+        'Transaction Reference': txn_ids,
+        'UserID.1': df['UserID'],
+        'CIFID': rng.integers(100000, 1000000, size=n),
+        'AUDIT_FIELD4': 'Payment Amount',
+        'Amount': amounts_int,
+        'Currency': 'SGD'
+    }
+    return pd.DataFrame(columns), int(spikes.sum()), len(duplicates)
+
+def generate_transactions(output_path, rows=100_000, users=1_000, merchants=200, user_skew=1.1,
+                          merchant_skew=1.0, anomaly_rate=0.01, start='2024-01-01', days=365, seed=0,
+                          chunk_rows=250_000):
+    """
+    Write a synthetic transactions CSV with the same header as
+    data/transactions.csv, in TXN_DATE order.
+
+    User and merchant activity follow Zipf-like weights (skew 0 = uniform),
+    amounts are log-normal around a per-user scale, and about anomaly_rate
+    of the rows are injected anomalies: half spending spikes, half
+    duplicates (same user, merchant and amount within 30 seconds), which add
+    to the row count. Rows are generated and written in chunks, so 10M rows
+    need no more memory than chunk_rows.
+
+    Returns a summary of what was written.
+    """
+    rng = np.random.default_rng(seed)
+    user_names = np.array([f"user{i:07d}" for i in range(users)], dtype=object)
+    merchant_names = np.array([f"M{i:05d}" for i in range(merchants)], dtype=object)
+    user_weights = _zipf_weights(users, user_skew)
+    merchant_weights = _zipf_weights(merchants, merchant_skew)
+    user_scale = rng.lognormal(5, 1, size=users)
+
+    start = pd.Timestamp(start)
+    total_seconds = days * 86400
+    chunks = max(1, -(-rows // chunk_rows))
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = output_path + '.tmp'
+    written = spikes = duplicates = 0
+    for chunk in range(chunks):
+        chunk_rows_now = min(chunk_rows, rows - chunk * chunk_rows)
+        # Each chunk covers its own slice of the date range, so the file stays sorted
+        chunk_start = start + pd.Timedelta(seconds=total_seconds * chunk // chunks)
+        chunk_seconds = total_seconds * (chunk + 1) // chunks - total_seconds * chunk // chunks
+        df, chunk_spikes, chunk_duplicates = _chunk(
+            rng, written + 1, chunk_rows_now, chunk_start, chunk_seconds, user_names, user_weights,
+            user_scale, merchant_names, merchant_weights, anomaly_rate
+        )
+        df.to_csv(tmp_path, mode='w' if chunk == 0 else 'a', header=CSV_COLUMNS if chunk == 0 else False,
+                  index=False)
+        written += len(df)
+        spikes += chunk_spikes
+        duplicates += chunk_duplicates
+    os.replace(tmp_path, output_path)
+
+    return {
+        'path': output_path,
+        'rows': written,
+        'users': users,
+        'merchants': merchants,
+        'user_skew': user_skew,
+        'merchant_skew': merchant_skew,
+        'anomaly_rate': anomaly_rate,
+        'injected_spikes': spikes,
+        'injected_duplicates': duplicates,
+        'seed': seed
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic transactions CSV.")
+    parser.add_argument('--output', default='benchmarks/data/transactions-synthetic.csv')
+    parser.add_argument('--rows', type=int, default=100_000, help="Base rows, before injected duplicates")
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--merchants', type=int, default=200)
+    parser.add_argument('--user-skew', type=float, default=1.1, help="Zipf exponent of activity per user")
+    parser.add_argument('--merchant-skew', type=float, default=1.0, help="Zipf exponent of activity per merchant")
+    parser.add_argument('--anomaly-rate', type=float, default=0.01)
+    parser.add_argument('--start', default='2024-01-01')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    summary = generate_transactions(
+        args.output,
+        rows=args.rows,
+        users=args.users,
+        merchants=args.merchants,
+        user_skew=args.user_skew,
+        merchant_skew=args.merchant_skew,
+        anomaly_rate=args.anomaly_rate,
+        start=args.start,
+        days=args.days,
+        seed=args.seed
+    )
+    print(f"Wrote {summary['rows']:,} rows for {summary['users']:,} users to {summary['path']} "
+          f"({summary['injected_spikes']:,} spikes, {summary['injected_duplicates']:,} duplicates injected).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+import subprocess
+import numpy as np
+import pandas as pd
+
+# Run from the repo root or this directory; make app.services.* importable
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from generate_data import generate_transactions
+from app.services.data_loader import load_and_clean_data
+from app.services import aggregation
+from app.services.anomaly_detector import (
+    DUPLICATE_WINDOW,
+    detect_duplicates,
+    detect_outliers,
+    detect_spending_spikes,
+    merge_anomalies
+)
+
+def _rows(result):
+    if isinstance(result, tuple):
+        return sum(_rows(part) for part in result)
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    return 1
+
+def _rss_bytes():
+    # Current resident set size; Linux only (None elsewhere)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _measure(func, repeat, memory):
+    """
+    Wall time of `repeat` runs. With memory=True a thread samples the RSS
+    every few milliseconds during each run; the peak growth over the RSS at
+    the start of the run is reported (tracemalloc would be exact but slows
+    sklearn about tenfold).
+    """
+    seconds = []
+    peak_bytes = None
+    for _ in range(repeat):
+        gc.collect()
+        start_rss = _rss_bytes() if memory else None
+        stop = threading.Event()
+        peaks = []
+        if start_rss is not None:
+            def sample():
+                peak = start_rss
+                while not stop.wait(0.005):
+                    peak = max(peak, _rss_bytes())
+                peaks.append(max(peak, _rss_bytes()))
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+
+        started = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - started)
+
+        if start_rss is not None:
+            stop.set()
+            sampler.join()
+            peak_bytes = max(peak_bytes or 0, peaks[0] - start_rss)
+
+    peak_mb = round(peak_bytes / 2 ** 20, 2) if peak_bytes is not None else None
+    return result, seconds, peak_mb
+
+def _benchmarks(path, profile, n_jobs):
+    """
+    (name, group, function of the earlier results) in run order; later
+    steps reuse earlier outputs the way the app does.
+    """
+    return [
+        ('load_and_clean_data', 'load', lambda r: load_and_clean_data(path, profile=profile)),
+        ('build_rollup', 'aggregation', lambda r: aggregation.build_rollup(r['load_and_clean_data'])),
+        ('calculate_total_spend', 'aggregation', lambda r: aggregation.calculate_total_spend(r['load_and_clean_data'])),
+        ('analyze_monthly_spend', 'aggregation', lambda r: aggregation.analyze_monthly_spend(r['load_and_clean_data'])),
+        ('binned_amount_distribution', 'aggregation',
+         lambda r: aggregation.binned_amount_distribution(r['load_and_clean_data'])),
+        ('spend_by_transaction_type', 'aggregation',
+         lambda r: aggregation.spend_by_transaction_type(r['load_and_clean_data'])),
+        ('build_merchant_table', 'aggregation', lambda r: aggregation.build_merchant_table(r['load_and_clean_data'])),
+        ('top_merchants', 'aggregation', lambda r: aggregation.top_merchants(r['load_and_clean_data'])),
+        ('transaction_frequency', 'aggregation', lambda r: aggregation.transaction_frequency(r['load_and_clean_data'])),
+        ('temporal_spend_trends', 'aggregation', lambda r: aggregation.temporal_spend_trends(r['load_and_clean_data'])),
+        ('weekday_vs_weekend_spend', 'aggregation',
+         lambda r: aggregation.weekday_vs_weekend_spend(r['load_and_clean_data'])),
+        ('peak_spending_hours', 'aggregation', lambda r: aggregation.peak_spending_hours(r['load_and_clean_data'])),
+        ('currency_spend_breakdown', 'aggregation',
+         lambda r: aggregation.currency_spend_breakdown(r['load_and_clean_data'])),
+        ('fee_analysis', 'aggregation', lambda r: aggregation.fee_analysis(r['load_and_clean_data'])),
+        ('calculate_rolling_spend', 'aggregation', lambda r: aggregation.calculate_rolling_spend(r['load_and_clean_data'])),
+        ('detect_recurring_payments', 'aggregation',
+         lambda r: aggregation.detect_recurring_payments(r['load_and_clean_data'], aggregation.RECURRING_INTERVALS)),
+        ('segment_users', 'aggregation', lambda r: aggregation.segment_users(r['calculate_total_spend'].copy())),
+        ('detect_outliers', 'anomaly', lambda r: detect_outliers(r['load_and_clean_data'], n_jobs=n_jobs)),
+        ('detect_spending_spikes', 'anomaly', lambda r: detect_spending_spikes(r['load_and_clean_data'])),
+        ('detect_duplicates', 'anomaly', lambda r: detect_duplicates(r['load_and_clean_data'], window=DUPLICATE_WINDOW)),
+        ('merge_anomalies', 'anomaly',
+         lambda r: merge_anomalies(r['detect_outliers'], r['detect_spending_spikes'], r['detect_duplicates']))
+    ]
+
+# Benchmarks whose inputs are other benchmarks' results
+DEPENDENCIES = {
+    'segment_users': ['calculate_total_spend'],
+    'merge_anomalies': ['detect_outliers', 'detect_spending_spikes', 'detect_duplicates']
+}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(path, profile='full', repeat=3, memory=True, only=None, n_jobs=1):
+    """
+    Time every benchmark on the CSV at `path` and return one record per
+    benchmark: best / median seconds, peak RSS growth (MB), rows in and
+    rows out.
+    """
+    if only is not None:
+        only = set(only) | {'load_and_clean_data'}
+        only |= {dependency for name in list(only) for dependency in DEPENDENCIES.get(name, [])}
+
+    results = {}
+    records = []
+    for name, group, func in _benchmarks(path, profile, n_jobs):
+        if only is not None and name not in only:
+            continue
+
+        # The loader runs once; everything else runs `repeat` times
+        runs = 1 if name == 'load_and_clean_data' else repeat
+        result, seconds, peak_mb = _measure(lambda: func(results), runs, memory)
+        results[name] = result
+
+        rows_in = _rows(results['load_and_clean_data']) if name != 'load_and_clean_data' else None
+        record = {
+            'name': name,
+            'group': group,
+            'best_seconds': round(min(seconds), 5),
+            'median_seconds': round(float(np.median(seconds)), 5),
+            'repeats': runs,
+            'peak_rss_mb': peak_mb,
+            'rows_in': rows_in,
+            'rows_out': _rows(result)
+        }
+        records.append(record)
+        peak = f", peak +{peak_mb:.1f} MB" if peak_mb is not None else ""
+        print(f"  {name:<28} {record['best_seconds']:>10.4f}s{peak}")
+    return records
+
+def compare(baseline_file, report, tolerance=1.25, min_difference=0.005):
+    """
+    Print best_seconds per benchmark against an earlier JSON report and
+    return the names slower than tolerance x baseline (same row count only).
+    Differences under min_difference seconds are timer noise and ignored.
+    """
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+
+    slower = []
+    for run in report['runs']:
+        old_run = next((old for old in baseline['runs'] if old['rows'] == run['rows']), None)
+        if old_run is None:
+            print(f"No baseline run with {run['rows']:,} rows.")
+            continue
+        old_results = {record['name']: record for record in old_run['results']}
+        print(f"\n{run['rows']:,} rows vs {baseline_file}:")
+        for record in run['results']:
+            old = old_results.get(record['name'])
+            if old is None or not old['best_seconds']:
+                continue
+            ratio = record['best_seconds'] / old['best_seconds']
+            regressed = ratio > tolerance and record['best_seconds'] - old['best_seconds'] > min_difference
+            flag = "  <-- slower" if regressed else ""
+            print(f"  {record['name']:<28} {old['best_seconds']:>10.4f}s -> {record['best_seconds']:>10.4f}s "
+                  f"({ratio:.2f}x){flag}")
+            if regressed:
+                slower.append(f"{run['rows']}:{record['name']}")
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading, aggregation and anomaly detection.")
+    parser.add_argument('--input', default=None,
+                        help="Benchmark this CSV instead of generated data")
+    parser.add_argument('--rows', type=int, nargs='*', default=[10_000, 100_000],
+                        help="Synthetic data sizes to run (e.g. 10000 100000 1000000 10000000)")
+    parser.add_argument('--users', type=int, default=None, help="Synthetic users (default: rows / 100)")
+    parser.add_argument('--merchants', type=int, default=500)
+    parser.add_argument('--user-skew', type=float, default=1.1)
+    parser.add_argument('--merchant-skew', type=float, default=1.0)
+    parser.add_argument('--anomaly-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='benchmarks/data', help="Where generated CSVs are kept and reused")
+    parser.add_argument('--profile', default='full', choices=['full', 'compact'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="Do not sample peak RSS")
+    parser.add_argument('--only', nargs='*', default=None, help="Only these benchmarks (by name)")
+    parser.add_argument('--jobs', type=int, default=1, help="n_jobs for detect_outliers")
+    parser.add_argument('--output', default=None, help="JSON report path (default: benchmarks/results/<time>.json)")
+    parser.add_argument('--compare', default=None, help="Earlier JSON report to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="With --compare, exit non-zero if any benchmark is this many times slower")
+    args = parser.parse_args(argv)
+
+    if args.input:
+        datasets = [(args.input, None)]
+    else:
+        datasets = []
+        for rows in args.rows:
+            users = args.users or max(10, rows // 100)
+            path = os.path.join(args.data_dir, f"synthetic-{rows}-{users}-{args.merchants}-"
+                                               f"{args.user_skew}-{args.merchant_skew}-{args.anomaly_rate}-"
+                                               f"{args.seed}.csv")
+            if os.path.exists(path):
+                datasets.append((path, None))
+                continue
+            print(f"Generating {rows:,} rows for {users:,} users...")
+            datasets.append((path, generate_transactions(
+                path, rows=rows, users=users, merchants=args.merchants, user_skew=args.user_skew,
+                merchant_skew=args.merchant_skew, anomaly_rate=args.anomaly_rate, seed=args.seed
+            )))
+
+    report = {
+        'created': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'profile': args.profile,
+        'repeat': args.repeat,
+        'runs': []
+    }
+
+    for path, generated in datasets:
+        print(f"\nBenchmarking {path}:")
+        results = run_benchmarks(path, profile=args.profile, repeat=args.repeat, memory=not args.no_memory,
+                                 only=args.only, n_jobs=args.jobs)
+        # Cleaned rows, i.e. what every benchmark after the loader works on
+        rows = results[0]['rows_out']
+        report['runs'].append({'input': path, 'rows': rows, 'generator': generated, 'results': results})
+
+    output = args.output or os.path.join('benchmarks', 'results',
+                                         f"{pd.Timestamp.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        slower = compare(args.compare, report, args.tolerance)
+        if slower:
+            print(f"\n{len(slower)} benchmarks slower than {args.tolerance}x baseline: {', '.join(slower)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,34 @@
+import time
 import streamlit as st
 import pandas as pd
-import os
-from app.services.data_loader import load_and_clean_data
-from app.services.aggregation import analyze_monthly_spend as get_monthly_spend, get_top_merchants_for_user
-from app.services.visualization import plot_monthly_spend, plot_transaction_distribution, plot_top_merchants, plot_peak_hours
-from app.services.anomaly_detector import detect_outliers, detect_spending_spikes, detect_duplicates, merge_anomalies, summarize_anomalies
+from app.services.data_loader import cleaned_parquet, load_and_clean_data, source_fingerprint
+from app.services.aggregation import (
+    analyze_monthly_spend as get_monthly_spend,
+    binned_amount_distribution,
+    build_merchant_table,
+    get_top_merchants_for_user,
+    peak_spending_hours
+)
+from app.services.visualization import CHARTS
+from app.services.anomaly_detector import (
+    ANOMALY_FLAGS,
+    DUPLICATE_WINDOW,
+    anomaly_flags,
+    duplicate_clusters,
+    flagged_anomalies,
+    sort_anomalies,
+    spending_spike_mask,
+    summarize_anomalies
+)
+from app.services.model_registry import OutlierModelRegistry
+from app.services.anomaly_store import AnomalyStore
+from app.services.result_cache import ResultCache
+from app.services.plot_cache import PlotCache
+from app.services import instrumentation
+
+# Per-stage timings of this rerun for the debug panel (TXN_INSTRUMENT=1)
+rerun_started = time.perf_counter()
+instrumentation.start_collecting()
 
 st.set_page_config(page_title="Tagit Transaction Dashboard", layout="wide")
 
@@ -14,12 +38,104 @@ st.markdown("""
     <hr style='border: 1px solid #E9ECEF;'>
 """, unsafe_allow_html=True)
 
+DATA_PATH = "data/transactions.csv"
+
+# Detector settings (DUPLICATE_WINDOW comes from the detector); part of
+# every cached result's key
+SPIKE_PERCENTILE = 95
+
 @st.cache_resource
 def get_data():
-    return load_and_clean_data("data/transactions.csv")
+    df, user_index = load_and_clean_data(DATA_PATH, cache_dir="outputs/cache", profile="compact", with_index=True)
+    return df, user_index, source_fingerprint(DATA_PATH)
+
+@st.cache_resource
+def get_model_registry():
+    return OutlierModelRegistry("outputs/models")
 
-raw_df = get_data()
-user_list = raw_df['UserID'].dropna().unique().tolist()
+@st.cache_resource
+def get_anomaly_store():
+    return AnomalyStore("outputs/anomalies.db")
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(max_entries=128, ttl_seconds=900)
+
+@st.cache_resource
+def get_plot_cache():
+    return PlotCache(max_entries=64, workers=2)
+
+def show_chart(chart, rendered):
+    # rendered: future of the chart's PNG from plot_cache.submit()
+    with instrumentation.timed(f"dashboard.chart.{chart}"):
+        png = rendered.result()
+    if png is None:
+        st.warning(CHARTS[chart][2])
+    else:
+        st.image(png, width="stretch")
+
+def full_profile_csv(user_id, start, end):
+    """
+    CSV of the user's cleaned rows from start to end with every raw column.
+    The dashboard works on the compact profile; this reads the full-profile
+    cache (built on first use), only when the download is clicked.
+    """
+    path = cleaned_parquet(DATA_PATH, cache_dir="outputs/cache", profile="full")
+    rows = pd.read_parquet(path, filters=[('UserID', '==', user_id)])
+    return rows[rows['TXN_DATE'].between(start, end)].to_csv(index=False)
+
+def analyze_anomalies(user_id, user_df, user_history, watermark):
+    """
+    Merged anomalies and per-type summary for the user's selected rows.
+    Precomputed anomalies come from the store; detection only runs for rows
+    past its watermark (all of them when there is no store). Either way rows
+    are scored against the user's full history, like the batch job does, and
+    only those in the selected range are kept.
+    """
+    if watermark is None:
+        merged_anomalies = pd.DataFrame()
+        fresh_df = user_df
+    else:
+        merged_anomalies = anomaly_store.query(user_id, user_df['TXN_DATE'].min(), user_df['TXN_DATE'].max())
+        fresh_df = user_df[user_df['TXN_DATE'] > watermark]
+
+    if not fresh_df.empty:
+        scored_df = user_history
+        duplicate_ids = duplicate_clusters(scored_df, window=DUPLICATE_WINDOW)
+        flags = anomaly_flags(
+            scored_df,
+            outliers=registry.outlier_mask(user_id, scored_df),
+            spikes=spending_spike_mask(scored_df, [SPIKE_PERCENTILE])[SPIKE_PERCENTILE],
+            duplicates=duplicate_ids >= 0
+        )
+
+        fresh = scored_df.index.isin(fresh_df.index)
+        fresh_anomalies = flagged_anomalies(scored_df[fresh], flags[fresh])
+        fresh_anomalies['Duplicate_Cluster'] = duplicate_ids[fresh & (flags > 0).to_numpy()].to_numpy()
+        if merged_anomalies.empty:
+            merged_anomalies = fresh_anomalies
+        else:
+            merged_anomalies = pd.concat([merged_anomalies, fresh_anomalies], ignore_index=True)
+
+    if not merged_anomalies.empty and 'UserID' in merged_anomalies.columns:
+        merged_anomalies = sort_anomalies(merged_anomalies)
+        summary = summarize_anomalies(merged_anomalies)
+    else:
+        summary = pd.DataFrame(columns=['UserID', 'Anomaly_Type', 'Anomaly_Count'])
+    return merged_anomalies, summary
+
+@st.cache_resource
+def get_merchant_table(_df, data_version):
+    # Per-user merchant counts / spend, built once per data version
+    return build_merchant_table(_df)
+
+raw_df, user_index, data_version = get_data()
+merchant_table = get_merchant_table(raw_df, data_version)
+registry = get_model_registry()
+anomaly_store = get_anomaly_store()
+result_cache = get_result_cache()
+plot_cache = get_plot_cache()
+user_list = user_index.users
 
 if "selected_user" not in st.session_state:
     st.session_state.selected_user = user_list[0] if user_list else ""
@@ -60,11 +176,13 @@ if not st.session_state.run_analysis:
     st.dataframe(raw_df.head(), use_container_width=True)
 
 if st.session_state.run_analysis:
-    user_df = raw_df[raw_df['UserID'] == st.session_state.selected_user]
+    user_history = user_index.rows(st.session_state.selected_user)
+    user_df = user_history
 
     if st.session_state.date_range and len(st.session_state.date_range) == 2:
-        user_df = user_df[(user_df['TXN_DATE'] >= pd.to_datetime(st.session_state.date_range[0])) &
-                          (user_df['TXN_DATE'] <= pd.to_datetime(st.session_state.date_range[1]))]
+        user_df = user_index.rows(st.session_state.selected_user,
+                                  pd.to_datetime(st.session_state.date_range[0]),
+                                  pd.to_datetime(st.session_state.date_range[1]))
 
     if user_df.empty:
         st.warning("No transactions found in selected range.")
@@ -77,23 +195,24 @@ if st.session_state.run_analysis:
         if len(user_df) < 10:
             st.warning("⚠️ Too few transactions to run reliable anomaly detection.")
 
+        # Results for the same user, date range and data are reused across reruns
+        date_key = tuple(str(d) for d in st.session_state.date_range) if len(st.session_state.date_range) == 2 else None
+        result_key = (st.session_state.selected_user, date_key, data_version)
+
         tabs = st.tabs(["📊 Overview", "💸 Spending Patterns", "⚠️ Anomaly Insights", "📤 Exports"])
 
         with tabs[0]:
             st.header(f"📊 Overview for User: {st.session_state.selected_user}")
             total_txns = len(user_df)
-            total_spend = user_df['TXN_AMOUNT'].sum()
-
-            outliers = detect_outliers(user_df)
-            spikes = detect_spending_spikes(user_df)
-            duplicates = detect_duplicates(user_df, round_to="minute")
+            # Compact amounts are float32; sum money in float64 so large totals stay exact
+            total_spend = user_df['TXN_AMOUNT'].astype('float64').sum()
 
-            merged_anomalies = merge_anomalies(outliers, spikes, duplicates)
-
-            if not merged_anomalies.empty and 'UserID' in merged_anomalies.columns:
-                summary = summarize_anomalies(merged_anomalies)
-            else:
-                summary = pd.DataFrame(columns=['UserID', 'Anomaly_Type', 'Anomaly_Count'])
+            watermark = anomaly_store.watermark()
+            with instrumentation.timed('dashboard.anomalies', len(user_df)):
+                merged_anomalies, summary = result_cache.get_or_compute(
+                    ('anomalies', *result_key, DUPLICATE_WINDOW, SPIKE_PERCENTILE, registry.contamination, watermark),
+                    analyze_anomalies, st.session_state.selected_user, user_df, user_history, watermark
+                )
 
             total_anomalies = len(merged_anomalies)
 
@@ -126,17 +245,17 @@ if st.session_state.run_analysis:
 
                     result_msgs = []
 
-                    if not detect_outliers(pd.concat([user_df, sim_txn])).tail(1).empty:
+                    if registry.score_transaction(st.session_state.selected_user, sim_txn.iloc[0], user_df=user_df):
                         result_msgs.append("Outlier")
 
-                    threshold = user_df['TXN_AMOUNT'].quantile(0.95)
+                    threshold = user_df['TXN_AMOUNT'].quantile(SPIKE_PERCENTILE / 100)
                     if txn_amt > threshold:
                         result_msgs.append("Spending Spike")
 
                     dup_check = user_df[
-                        (user_df['TXN_DATE'].dt.floor('min') == sim_txn['TXN_DATE'].iloc[0].floor('min')) &
+                        ((user_df['TXN_DATE'] - sim_txn['TXN_DATE'].iloc[0]).abs() <= pd.Timedelta(DUPLICATE_WINDOW)) &
                         (user_df['MERC_TXN_ID'] == merchant_id) &
-                        (user_df['TXN_AMOUNT'] == txn_amt)
+                        (user_df['TXN_AMOUNT'] == user_df['TXN_AMOUNT'].dtype.type(txn_amt))
                     ]
                     if not dup_check.empty:
                         result_msgs.append("Duplicate Transaction")
@@ -148,42 +267,60 @@ if st.session_state.run_analysis:
 
         with tabs[1]:
             st.header("💸 Spending Patterns")
-            monthly = get_monthly_spend(user_df)
+            with instrumentation.timed('dashboard.spending_patterns', len(user_df)):
+                monthly = result_cache.get_or_compute(('monthly', *result_key), get_monthly_spend, user_df)
+                top_merchant_volume, top_merchant_value = result_cache.get_or_compute(
+                    ('top_merchants', *result_key), get_top_merchants_for_user,
+                    raw_df, st.session_state.selected_user, merchant_table=merchant_table
+                )
+
+                # Charts get pre-aggregated inputs (bins, hourly sums), so hashing and
+                # drawing cost does not grow with the user's history; they are cached
+                # on that hash and only changed ones are redrawn
+                chart_data = {
+                    'monthly_spend': monthly,
+                    'transaction_distribution': result_cache.get_or_compute(
+                        ('amount_bins', *result_key), binned_amount_distribution, user_df),
+                    'top_merchants': top_merchant_value,
+                    'peak_hours': result_cache.get_or_compute(('hourly', *result_key), peak_spending_hours, user_df)
+                }
+            charts = {chart: plot_cache.submit(chart, data, st.session_state.selected_user)
+                      for chart, data in chart_data.items()}
+
             with st.container():
                 st.markdown("#### Monthly Spending Trend")
                 st.markdown("This chart shows how the user's monthly transaction behavior evolved over time. Peaks and lows are highlighted.")
                 st.divider()
                 if not monthly.empty:
-                    plot_monthly_spend(monthly, st.session_state.selected_user)
+                    show_chart('monthly_spend', charts['monthly_spend'])
             with st.container():
                 st.markdown("#### Transaction Distribution")
                 st.markdown("Distribution of transaction amounts — mean, median and skew are visualized.")
                 st.divider()
-                plot_transaction_distribution(user_df, st.session_state.selected_user)
+                show_chart('transaction_distribution', charts['transaction_distribution'])
             with st.container():
                 st.markdown("#### Top Merchants")
                 st.markdown("Displays the top 10 merchants this user spent the most on. Spend and transaction count shown.")
-                top_merchant_volume, top_merchant_value = get_top_merchants_for_user(raw_df, st.session_state.selected_user)
                 merchant_count = top_merchant_value['MERC_TXN_ID'].nunique() if not top_merchant_value.empty else 0
                 st.markdown(f"**Merchants Analyzed:** {merchant_count}")
                 st.divider()
                 if not top_merchant_value.empty:
-                    plot_top_merchants(top_merchant_value, st.session_state.selected_user)
+                    show_chart('top_merchants', charts['top_merchants'])
             with st.container():
                 st.markdown("#### Peak Spending Hours")
                 st.markdown("Hourly distribution of spend — see when users transact most and least.")
                 st.divider()
-                plot_peak_hours(user_df, st.session_state.selected_user)
+                show_chart('peak_hours', charts['peak_hours'])
 
         with tabs[2]:
             st.header("⚠️ Anomaly Insights")
             st.subheader("Flagged Transactions")
-            st.markdown("Spending spikes are transactions above the 95th percentile of past behavior. Outliers are based on Isolation Forest. Duplicates use exact matches within close timestamps.")
+            st.markdown("Spending spikes are transactions above the 95th percentile of past behavior. Outliers are based on Isolation Forest. Duplicates are identical merchant and amount within 60 seconds.")
             anomaly_filter = st.radio("Filter by Type", ["All", "Outlier", "Spending Spike", "Duplicate Transaction"])
 
             filtered_anomalies = merged_anomalies
             if anomaly_filter != "All":
-                filtered_anomalies = merged_anomalies[merged_anomalies['Anomaly_Type'].str.contains(anomaly_filter)]
+                filtered_anomalies = merged_anomalies[(merged_anomalies['Anomaly_Flags'] & ANOMALY_FLAGS[anomaly_filter]) > 0]
 
             reviewed = st.checkbox("Mark anomalies as reviewed")
             st.data_editor(filtered_anomalies, use_container_width=True, disabled=not reviewed)
@@ -195,18 +332,44 @@ if st.session_state.run_analysis:
                 st.markdown("""
                 - **Outliers**: Detected using Isolation Forest, based on historical transaction behavior.
                 - **Spending Spikes**: Transactions above the 95th percentile.
-                - **Duplicates**: Same UserID + Date + Merchant + Amount, within close time windows.
+                - **Duplicates**: Same UserID + Merchant + Amount, within 60 seconds of each other.
                 """)
 
         with tabs[3]:
             st.header("📤 Exports")
-            st.download_button("Download Cleaned Data", data=user_df.to_csv(index=False), file_name="cleaned_data.csv")
+            export_user = st.session_state.selected_user
+            export_start, export_end = user_df['TXN_DATE'].min(), user_df['TXN_DATE'].max()
+            st.download_button("Download Cleaned Data",
+                               data=lambda: full_profile_csv(export_user, export_start, export_end),
+                               file_name="cleaned_data.csv")
             st.download_button("Download Anomalies", data=merged_anomalies.to_csv(index=False), file_name="anomalies.csv")
-            os.makedirs("outputs/plots", exist_ok=True)
-            if not monthly.empty:
-                plot_monthly_spend(monthly, st.session_state.selected_user, save_path="outputs/plots")
-            if not top_merchant_value.empty:
-                plot_top_merchants(top_merchant_value, st.session_state.selected_user, save_path="outputs/plots")
-            plot_transaction_distribution(user_df, st.session_state.selected_user, save_path="outputs/plots")
-            plot_peak_hours(user_df, st.session_state.selected_user, save_path="outputs/plots")
-            st.success("All visualizations saved in outputs/plots/")
+
+            # Saved in the background from the chart cache; unchanged files are not rewritten
+            exports = [plot_cache.export(chart, data, st.session_state.selected_user, save_path="outputs/plots")
+                       for chart, data in chart_data.items() if not data.empty]
+            failed = [future.exception() for future in exports if future.done() and future.exception()]
+            if failed:
+                st.error(f"Saving visualizations failed: {failed[0]}")
+            elif all(future.done() for future in exports):
+                st.success("All visualizations saved in outputs/plots/")
+            else:
+                st.info("Saving visualizations to outputs/plots/ in the background.")
+
+cache_stats = result_cache.stats()
+st.sidebar.divider()
+st.sidebar.caption(
+    f"Result cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · "
+    f"{cache_stats['entries']} entries ({cache_stats['hit_rate']:.0%} hit rate)"
+)
+plot_stats = plot_cache.stats()
+st.sidebar.caption(
+    f"Chart cache: {plot_stats['renders']} renders · {plot_stats['hits']} hits · {plot_stats['writes']} files written"
+)
+
+if instrumentation.ENABLED:
+    # Charts render on the chart cache's threads; here they show as the wait for each one
+    stage_timings = instrumentation.stage_report(instrumentation.stop_collecting())
+    with st.expander("🐞 Debug: stage timings for this rerun"):
+        st.caption(f"Rerun took {time.perf_counter() - rerun_started:.3f}s · cached results and charts are not "
+                   f"recomputed, so only stages that ran are listed · log: {instrumentation.LOG_PATH or 'off'}")
+        st.dataframe(stage_timings, width="stretch", hide_index=True)